@@ -0,0 +1,89 @@
+"""Микробенчмарк: вставки в messages — connect на каждый вызов против db.Database.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_db.py [--inserts 2000] [--threads 1 4 8]
+
+Первый вариант повторяет старый save_message(): sqlite3.connect → INSERT →
+commit → close в режиме журнала по умолчанию. Второй — тот же INSERT через
+пул соединений db.Database (WAL, synchronous=NORMAL, кэш запросов).
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        message TEXT,
+        is_from_user BOOLEAN,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+INSERT = 'INSERT INTO messages (user_id, message, is_from_user) VALUES (?, ?, ?)'
+
+
+def insert_connect_per_call(path, user_id, n, errors):
+    for i in range(n):
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute(INSERT, (user_id, f"📚 Каталог {i}", True))
+            conn.commit()
+        except sqlite3.OperationalError:
+            errors.append(1)
+        finally:
+            conn.close()
+
+
+def insert_pooled(db, user_id, n, errors):
+    for i in range(n):
+        try:
+            db.execute(INSERT, (user_id, f"📚 Каталог {i}", True))
+        except sqlite3.OperationalError:
+            errors.append(1)
+
+
+def run(label, target, threads, per_thread):
+    errors = []
+    workers = [threading.Thread(target=target, args=(t, per_thread, errors)) for t in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    total = threads * per_thread
+    print(f"{label:<22} потоков={threads:<3} вставок={total:<6} {total / elapsed:>10.0f} вст/с  ошибок={len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inserts", type=int, default=2000, help="вставок на поток")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    for threads in args.threads:
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy_path = os.path.join(tmp, "legacy.db")
+            conn = sqlite3.connect(legacy_path)
+            conn.execute(SCHEMA)
+            conn.close()
+            run("connect на вызов", lambda t, n, e: insert_connect_per_call(legacy_path, t, n, e), threads, args.inserts)
+
+            db = Database(os.path.join(tmp, "pooled.db"))
+            db.execute(SCHEMA)
+            run("db.Database (WAL)", lambda t, n, e: insert_pooled(db, t, n, e), threads, args.inserts)
+            db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Бенчмарк диспетчеризации: цепочка лямбд telebot против router.UpdateRouter.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_router.py [--handlers 10 50 200 1000] [--rounds 2000]
+
+Для каждого размера регистрируется N кнопок меню и N callback-префиксов.
+Измеряется время process_new_messages / process_new_callback_query для
+последнего зарегистрированного обработчика (худший случай для цепочки):
+в первом варианте — обычными @bot.message_handler(func=lambda ...), во
+втором — через роутер. Сеть не используется: обработчики пустые.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot  # noqa: E402
+from telebot import types  # noqa: E402
+
+from router import UpdateRouter  # noqa: E402
+
+TOKEN = "123456:BENCHMARK"
+
+
+def make_message(text):
+    return types.Message.de_json({
+        "message_id": 1, "date": 0, "text": text,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+    })
+
+
+def make_call(data):
+    return types.CallbackQuery.de_json({
+        "id": "1", "chat_instance": "1", "data": data,
+        "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "x"},
+    })
+
+
+def noop(_):
+    pass
+
+
+def build_chain(n):
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+    for i in range(n):
+        bot.register_message_handler(noop, func=lambda m, text=f"Кнопка {i}": m.text == text)
+        bot.register_callback_query_handler(noop, func=lambda c, prefix=f"action{i}_": c.data.startswith(prefix))
+    return bot
+
+
+def build_router(n):
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+    router = UpdateRouter()
+    router.install(bot)
+    for i in range(n):
+        router.text(f"Кнопка {i}")(noop)
+        router.callback(prefix=f"action{i}_")(noop)
+    return bot
+
+
+def measure(bot, n, rounds):
+    message = make_message(f"Кнопка {n - 1}")
+    call = make_call(f"action{n - 1}_payload")
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        bot.process_new_messages([message])
+    text_us = (time.perf_counter() - started) / rounds * 1e6
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        bot.process_new_callback_query([call])
+    callback_us = (time.perf_counter() - started) / rounds * 1e6
+    return text_us, callback_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--handlers", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'обработчиков':>12} | {'цепочка: текст':>15} {'callback':>10} | {'роутер: текст':>14} {'callback':>10}  (мкс на апдейт)")
+    for n in args.handlers:
+        chain_text, chain_cb = measure(build_chain(n), n, args.rounds)
+        router_text, router_cb = measure(build_router(n), n, args.rounds)
+        print(f"{n:>12} | {chain_text:>15.1f} {chain_cb:>10.1f} | {router_text:>14.1f} {router_cb:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Реализует методы, которыми пользуется бот (sendMessage, sendPhoto,
+sendMediaGroup, answerCallbackQuery, setWebhook и служебные getMe,
+getWebhookInfo, deleteWebhook, getUpdates), с настраиваемой задержкой
+ответа и долей ответов 429. Считает вызовы по методам и объём
+загруженных байтов; статистика доступна по GET /stats.
+
+getUpdates работает как long polling: если новых апдейтов нет, ответ
+ждёт их до timeout секунд. Апдейты добавляет push_updates().
+
+Отдельный запуск:
+
+    python benchmarks/fake_bot_api.py --port 8081 --latency-ms 50 --rate-429 0.01
+
+Боту нужно указать TELEGRAM_API_URL=http://127.0.0.1:8081.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeBotApi:
+    """Состояние заглушки: настройки, счётчики и генератор id."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0, retry_after=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.webhook_url = ""
+        self.pending_updates = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self.calls = Counter()
+        self.bytes_uploaded = 0
+        self.injected_429 = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "bytes_uploaded": self.bytes_uploaded,
+                "injected_429": self.injected_429,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.bytes_uploaded = 0
+            self.injected_429 = 0
+
+    def push_updates(self, updates):
+        """Ставит апдейты в очередь getUpdates и будит ждущие опросы."""
+        with self._updates_ready:
+            self.pending_updates.extend(updates)
+            self._updates_ready.notify_all()
+
+    def _message(self, chat_id, **extra):
+        message = {"message_id": next(self._ids), "date": int(time.time()),
+                   "chat": {"id": int(chat_id or 0), "type": "private"}}
+        message.update(extra)
+        return message
+
+    def _photo(self):
+        n = next(self._ids)
+        return [{"file_id": f"fake-photo-{n}", "file_unique_id": f"u{n}", "width": 1280, "height": 960}]
+
+    def handle(self, method, params, body_size):
+        """Возвращает (HTTP-статус, JSON-ответ) для вызова метода."""
+        with self._lock:
+            self.calls[method] += 1
+            self.bytes_uploaded += body_size
+
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+
+        if method.startswith("send") and random.random() < self.rate_429:
+            with self._lock:
+                self.injected_429 += 1
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+
+        chat_id = params.get("chat_id")
+        if method == "sendMessage":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=self._photo())
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            result = [self._message(chat_id, photo=self._photo()) for _ in media]
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook_url = ""
+            result = True
+        elif method == "getUpdates":
+            offset = int(params.get("offset", 0) or 0)
+            limit = int(params.get("limit", 100) or 100)
+            deadline = time.monotonic() + float(params.get("timeout", 0) or 0)
+            with self._updates_ready:
+                while True:
+                    self.pending_updates = [u for u in self.pending_updates if u["update_id"] >= offset]
+                    remaining = deadline - time.monotonic()
+                    if self.pending_updates or remaining <= 0:
+                        break
+                    self._updates_ready.wait(remaining)
+                result = self.pending_updates[:limit]
+        else:
+            result = True
+        return 200, {"ok": True, "result": result}
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _dispatch(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                return self._reply(200, api.stats())
+
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+
+            # /bot<token>/<method>
+            parts = url.path.strip("/").split("/")
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                return self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            status, payload = api.handle(parts[1], params, len(body) + len(url.query))
+            self._reply(status, payload)
+
+        do_GET = _dispatch
+        do_POST = _dispatch
+
+    return Handler
+
+
+def start_server(api, host="127.0.0.1", port=0):
+    """Запускает заглушку в фоновом потоке; возвращает (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля send*-запросов, получающих 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    fake_api = FakeBotApi(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after)
+    server, base_url = start_server(fake_api, args.host, args.port)
+    print(f"🧪 Заглушка Bot API: {base_url} (статистика: {base_url}/stats)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
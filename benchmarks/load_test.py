@@ -0,0 +1,218 @@
+"""Сквозной нагрузочный тест бота против локальной заглушки Bot API.
+
+Запуск из корня репозитория:
+
+    python benchmarks/load_test.py [--rate 50] [--sessions 200] [--concurrency 20]
+                                   [--latency-ms 30] [--rate-429 0.01] [--chat-rate 1]
+                                   [--runtime polling] [--poll-timeout 5]
+
+Скрипт поднимает заглушку (benchmarks/fake_bot_api.py), импортирует main.py
+с TELEGRAM_API_URL на неё и временной базой, запускает Flask-приложение на
+свободном порту и шлёт синтетические сессии (benchmarks/sessions.py) в
+/webhook с заданной частотой. Измеряются:
+
+- время ответа вебхука (ack) — то, что видит Telegram;
+- сквозная задержка — от отправки апдейта до конца его обработки воркером,
+  включая все вызовы Bot API с учётом лимитов планировщика;
+- пропускная способность, число ответов 503 и объём загруженных байтов.
+
+С --runtime polling бот запускается в режиме long polling (BOT_RUNTIME=
+polling): апдейты с той же частотой кладутся в очередь getUpdates
+заглушки, а сквозная задержка включает ожидание очередного опроса.
+Так два режима сравниваются на одной и той же нагрузке.
+
+С --webhook-url апдейты идут в уже запущенного бота (например, под
+gunicorn с TELEGRAM_API_URL на отдельно запущенную заглушку); тогда
+измеряется только ack, а статистика Bot API берётся из --api-url.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+
+from fake_bot_api import FakeBotApi, start_server  # noqa: E402
+from sessions import SessionGenerator  # noqa: E402
+
+TOKEN = "123456:LOADTEST"
+
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу; None для пустой выборки."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def format_ms(seconds):
+    return "—" if seconds is None else f"{seconds * 1000:.1f} мс"
+
+
+def start_local_bot(api_url, args):
+    """Импортирует main.py с окружением теста и запускает его на свободном порту."""
+    from werkzeug.serving import make_server
+
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": api_url,
+        "WEBHOOK_HOST": "",
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="blinds-load-"), "load.db"),
+        "TG_GLOBAL_RATE": str(args.global_rate),
+        "TG_CHAT_RATE": str(args.chat_rate),
+        "UPDATE_WORKERS": str(args.workers),
+        "BOT_RUNTIME": args.runtime,
+        "POLLING_TIMEOUT": str(args.poll_timeout),
+    })
+    os.chdir(ROOT)
+    import main
+
+    finished = {}
+    handler = main.update_workers.handler
+
+    def timed_handler(update):
+        try:
+            handler(update)
+        finally:
+            finished[update.update_id] = time.perf_counter()
+
+    main.update_workers.handler = timed_handler
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bot-http", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/webhook", finished
+
+
+def drive(webhook_url, updates, rate, clients):
+    """Шлёт апдейты с частотой rate в секунду; возвращает {update_id: (sent, ack, status)}."""
+    results = {}
+    local = threading.local()
+
+    def post(update, sent):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            status = session.post(webhook_url, data=json.dumps(update),
+                                  headers={"Content-Type": "application/json"}, timeout=30).status_code
+        except requests.RequestException:
+            status = None
+        results[update["update_id"]] = (sent, time.perf_counter() - sent, status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for i, update in enumerate(updates):
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(post, update, time.perf_counter())
+    return results, time.perf_counter() - started
+
+
+def push(fake_api, updates, rate):
+    """Кладёт апдейты в очередь getUpdates с частотой rate; ack для long polling не бывает."""
+    results = {}
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.perf_counter()
+        results[update["update_id"]] = (sent, None, 200)
+        fake_api.push_updates([update])
+    return results, time.perf_counter() - started
+
+
+def wait_processed(finished, accepted, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not accepted.issubset(finished):
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=50, help="апдейтов в секунду")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20, help="одновременно активных пользователей")
+    parser.add_argument("--fabric-pages", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=32, help="параллельных HTTP-соединений драйвера")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="задержка ответа заглушки")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--global-rate", type=float, default=30.0, help="TG_GLOBAL_RATE бота")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="TG_CHAT_RATE бота")
+    parser.add_argument("--workers", type=int, default=4, help="UPDATE_WORKERS бота")
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--webhook-url", help="внешний бот вместо запуска main.py в процессе")
+    parser.add_argument("--api-url", help="внешняя заглушка Bot API (со статистикой /stats)")
+    parser.add_argument("--runtime", choices=["webhook", "polling"], default="webhook", help="BOT_RUNTIME бота")
+    parser.add_argument("--poll-timeout", type=int, default=5, help="POLLING_TIMEOUT бота, секунд")
+    args = parser.parse_args()
+    if args.runtime == "polling" and (args.webhook_url or args.api_url):
+        parser.error("--runtime polling работает только с ботом и заглушкой в этом процессе")
+
+    fake_api = None
+    api_url = args.api_url
+    if not api_url:
+        fake_api = FakeBotApi(args.latency_ms, args.jitter_ms, args.rate_429)
+        _, api_url = start_server(fake_api)
+
+    finished = None
+    webhook_url = args.webhook_url
+    if not webhook_url:
+        _, webhook_url, finished = start_local_bot(api_url, args)
+    requests.get(f"{api_url}/stats", timeout=5)  # прогрев соединения и проверка заглушки
+    if fake_api:
+        fake_api.reset()  # вызовы при старте (getWebhookInfo и т.п.) в отчёт не входят
+
+    updates = list(SessionGenerator(args.seed, fabric_pages=args.fabric_pages)
+                   .interleave(args.sessions, args.concurrency))
+    target = "long polling" if args.runtime == "polling" else f"вебхук {webhook_url}"
+    print(f"🚀 Апдейтов: {len(updates)}, целевая частота {args.rate:g}/с, {target}")
+
+    if args.runtime == "polling":
+        results, send_elapsed = push(fake_api, updates, args.rate)
+    else:
+        results, send_elapsed = drive(webhook_url, updates, args.rate, args.clients)
+    accepted = {uid for uid, (_, _, status) in results.items() if status == 200}
+    if finished is not None:
+        wait_processed(finished, accepted, args.drain_timeout)
+    api_stats = requests.get(f"{api_url}/stats", timeout=5).json()
+
+    acks = [ack for _, ack, _ in results.values() if ack is not None]
+    busy = sum(1 for _, _, status in results.values() if status == 503)
+    failed = len(results) - len(accepted) - busy
+    print(f"\n📨 Отправлено {len(results)} за {send_elapsed:.1f} с "
+          f"({len(results) / send_elapsed:.1f}/с): принято {len(accepted)}, 503 — {busy}, ошибок — {failed}")
+    if acks:
+        print(f"⏱️ Ответ вебхука: p50 {format_ms(percentile(acks, 50))}, "
+              f"p95 {format_ms(percentile(acks, 95))}, p99 {format_ms(percentile(acks, 99))}")
+
+    if finished is not None:
+        done = [uid for uid in accepted if uid in finished]
+        e2e = [finished[uid] - results[uid][0] for uid in done]
+        if done:
+            first_sent = min(results[uid][0] for uid in done)
+            span = max(finished[uid] for uid in done) - first_sent
+            print(f"⚙️ Обработано {len(done)}/{len(accepted)} ({len(done) / span:.1f}/с)")
+        print(f"⏱️ Сквозная задержка: p50 {format_ms(percentile(e2e, 50))}, "
+              f"p95 {format_ms(percentile(e2e, 95))}, p99 {format_ms(percentile(e2e, 99))}")
+
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(api_stats["calls"].items()))
+    print(f"📡 Вызовы Bot API: {calls or '—'}")
+    print(f"📦 Загружено в Bot API: {api_stats['bytes_uploaded'] / 1024 / 1024:.2f} МБ, "
+          f"ответов 429: {api_stats['injected_429']}")
+
+
+if __name__ == '__main__':
+    main()
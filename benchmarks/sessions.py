@@ -0,0 +1,90 @@
+"""Генератор синтетических апдейтов для нагрузочного теста.
+
+Каждая сессия — последовательность апдейтов одного пользователя, похожая
+на реальную: /start, каталог и карточки категории, листание образцов
+тканей и заявка на звонок. Сессии разных пользователей перемешиваются
+(interleave), порядок апдейтов внутри сессии сохраняется. Кнопки
+нажимаются с теми же callback-токенами, что рисует бот (keyboards.CODEC).
+"""
+import itertools
+import random
+import time
+
+from keyboards import CATALOG_CATEGORIES, CODEC, FABRIC_CATEGORY_NAMES
+
+
+class SessionGenerator:
+    """Выдаёт JSON-апдейты в формате Bot API с растущими update_id."""
+
+    def __init__(self, seed=0, first_chat_id=100000, fabric_pages=2, call_request_share=0.3):
+        self.random = random.Random(seed)
+        self.fabric_pages = fabric_pages
+        self.call_request_share = call_request_share
+        self._update_ids = itertools.count(1)
+        self._chat_ids = itertools.count(first_chat_id)
+
+    def _user(self, chat_id):
+        return {"id": chat_id, "is_bot": False, "first_name": f"Load{chat_id}"}
+
+    def message(self, chat_id, text=None, **extra):
+        update_id = next(self._update_ids)
+        message = {"message_id": update_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "from": self._user(chat_id)}
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        message.update(extra)
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, chat_id, data):
+        update_id = next(self._update_ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "chat_instance": str(chat_id), "data": data, "from": self._user(chat_id),
+            "message": {"message_id": update_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"}, "text": "menu"},
+        }}
+
+    def session(self):
+        """Апдейты одной сессии нового пользователя."""
+        chat_id = next(self._chat_ids)
+        category = self.random.randrange(len(CATALOG_CATEGORIES))
+        fabric = self.random.randrange(len(FABRIC_CATEGORY_NAMES))
+
+        updates = [
+            self.message(chat_id, "/start"),
+            self.message(chat_id, "📚 Каталог"),
+            self.callback(chat_id, CODEC.encode("catalog_category", category)),
+            self.message(chat_id, "🧵 Ткани"),
+            self.callback(chat_id, CODEC.encode("fabric_category", fabric)),
+        ]
+        for page in range(1, self.fabric_pages):
+            updates.append(self.callback(chat_id, CODEC.encode("fabric_page", fabric, page * 10)))
+        if self.random.random() < self.call_request_share:
+            updates.append(self.callback(chat_id, "request_call"))
+            updates.append(self.message(chat_id, contact={
+                "phone_number": f"+7900{chat_id:07d}", "first_name": f"Load{chat_id}", "user_id": chat_id,
+            }))
+        return updates
+
+    def interleave(self, sessions, concurrency):
+        """Перемешивает сессии: одновременно активны не больше concurrency пользователей.
+
+        update_id перенумеровываются в порядке выдачи, как их присваивает
+        Telegram: на этом держится offset в getUpdates (см. polling.py).
+        """
+        pending = iter(range(sessions))
+        update_ids = itertools.count(1)
+        active = []
+        while True:
+            while len(active) < concurrency and next(pending, None) is not None:
+                active.append(iter(self.session()))
+            if not active:
+                return
+            stream = self.random.choice(active)
+            update = next(stream, None)
+            if update is None:
+                active.remove(stream)
+            else:
+                update["update_id"] = next(update_ids)
+                yield update
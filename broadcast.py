@@ -0,0 +1,213 @@
+"""Рассылка менеджера всем пользователям из таблицы users.
+
+Рассылка — это строка таблицы broadcasts (draft → running → done или
+cancelled). Выполняет её фоновый поток Broadcaster:
+
+* Пользователи читаются страницами по ключу (user_id > курсор ORDER BY
+  user_id), без OFFSET, так что каждая страница стоит одинаково.
+* Страница отправляется пулом потоков с приоритетом PRIORITY_BULK: темп
+  задаёт общий лимит SendScheduler, а ответы живым пользователям идут
+  вне очереди. Фото передаётся по file_id — Telegram хранит его один раз.
+* После каждой страницы курсор и счётчики сохраняются в SQLite в одной
+  транзакции с удалением пользователей, заблокировавших бота (403).
+  После перезапуска рассылка продолжается с сохранённого курсора;
+  повторно могут уйти только сообщения незавершённой страницы.
+* Рассылку выполняет один процесс: он берёт её в «аренду» (lease_until)
+  и продлевает аренду на каждой странице. Аренда упавшего процесса
+  истекает, и рассылку подхватывает другой.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+from metrics import BROADCAST_SENDS
+from send_scheduler import PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+RESULT_DELIVERED = "delivered"
+RESULT_BLOCKED = "blocked"
+RESULT_FAILED = "failed"
+
+BROADCAST_CLAIM = '''
+    UPDATE broadcasts SET lease_until = ?, owner = ?
+    WHERE id = (
+        SELECT id FROM broadcasts WHERE status = 'running' AND lease_until < ? ORDER BY id LIMIT 1
+    )
+    RETURNING id
+'''
+
+
+class Broadcaster:
+    """Создание, запуск и фоновое выполнение рассылок."""
+
+    LEASE = 60  # секунд; продлевается на каждой странице
+
+    def __init__(self, db, bot, scheduler=None, workers=10, page_size=100, poll_interval=10.0, on_finish=None):
+        self.db = db
+        self.bot = bot
+        self.scheduler = scheduler
+        self.workers = workers
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+        self.on_finish = on_finish  # функция(job) после завершения или отмены
+        self.owner = f"{os.getpid()}-{id(self)}"
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # === Публичный интерфейс ===
+    def create(self, text, photo_file_id=None, created_by=None):
+        """Черновик рассылки; возвращает его id."""
+        cursor = self.db.execute(
+            "INSERT INTO broadcasts (text, photo_file_id, created_by, created_at) VALUES (?, ?, ?, ?)",
+            (text, photo_file_id, created_by, time.time())
+        )
+        return cursor.lastrowid
+
+    def start(self, job_id):
+        """Запускает черновик; False, если он уже запущен или отменён."""
+        cursor = self.db.execute(
+            "UPDATE broadcasts SET status = 'running', started_at = ? WHERE id = ? AND status = 'draft'",
+            (time.time(), job_id)
+        )
+        self._wake.set()
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id):
+        """Отменяет черновик или идущую рассылку (остановится после текущей страницы)."""
+        cursor = self.db.execute(
+            "UPDATE broadcasts SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('draft', 'running')",
+            (time.time(), job_id)
+        )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        cursor = self.db.execute("SELECT * FROM broadcasts WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def audience_size(self):
+        return self.db.fetchone("SELECT COUNT(*) FROM users")[0]
+
+    def start_worker(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=30):
+        """Останавливает поток после текущей страницы; рассылка продолжится при следующем запуске."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    # === Внутренняя кухня ===
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                rows = self.db.fetchall(BROADCAST_CLAIM, (time.time() + self.LEASE, self.owner, time.time()))
+                if rows:
+                    self._execute(rows[0][0])
+                    continue
+            except Exception as e:
+                logger.error("Ошибка выполнения рассылки: %s", e)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _execute(self, job_id):
+        job = self.get(job_id)
+        logger.info("Рассылка %s: продолжаем после user_id %s", job_id, job["cursor_user_id"],
+                    extra={"broadcast_id": job_id})
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="broadcast-send") as pool:
+            cursor_user_id = job["cursor_user_id"]
+            while not self._stopping.is_set():
+                user_ids = [row[0] for row in self.db.fetchall(
+                    "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (cursor_user_id, self.page_size)
+                )]
+                if not user_ids:
+                    self._finish(job_id)
+                    return
+
+                started = time.monotonic()
+                results = list(pool.map(lambda user_id: self._send_one(job, user_id), user_ids))
+                cursor_user_id = user_ids[-1]
+                if not self._checkpoint(job_id, cursor_user_id, user_ids, results, time.monotonic() - started):
+                    logger.info("Рассылка %s отменена", job_id, extra={"broadcast_id": job_id})
+                    self._report(job_id)
+                    return
+
+        # Остановка процесса: отпускаем аренду, чтобы рассылку сразу подхватили
+        self.db.execute("UPDATE broadcasts SET lease_until = 0 WHERE id = ? AND owner = ?", (job_id, self.owner))
+
+    def _send_one(self, job, user_id):
+        try:
+            if self.scheduler is not None:
+                with self.scheduler.priority(PRIORITY_BULK):
+                    self._send(job, user_id)
+            else:
+                self._send(job, user_id)
+            result = RESULT_DELIVERED
+        except ApiTelegramException as e:
+            result = RESULT_BLOCKED if e.error_code == 403 else RESULT_FAILED
+        except Exception as e:
+            logger.warning("Рассылка %s: не доставлено: %s", job["id"], e, extra={"user_id": user_id})
+            result = RESULT_FAILED
+        BROADCAST_SENDS.inc(result)
+        return result
+
+    def _send(self, job, user_id):
+        if job["photo_file_id"]:
+            self.bot.send_photo(user_id, job["photo_file_id"], caption=job["text"] or None)
+        else:
+            self.bot.send_message(user_id, job["text"])
+
+    def _checkpoint(self, job_id, cursor_user_id, user_ids, results, elapsed):
+        """Сохраняет прогресс страницы; False, если рассылку тем временем отменили."""
+        blocked = [user_id for user_id, result in zip(user_ids, results) if result == RESULT_BLOCKED]
+        with self.db.transaction() as cursor:
+            updated = cursor.execute('''
+                UPDATE broadcasts SET
+                    cursor_user_id = ?, delivered = delivered + ?, failed = failed + ?, blocked = blocked + ?,
+                    elapsed = elapsed + ?, lease_until = ?
+                WHERE id = ? AND status = 'running'
+            ''', (cursor_user_id, results.count(RESULT_DELIVERED), results.count(RESULT_FAILED), len(blocked),
+                  elapsed, time.time() + self.LEASE, job_id)).rowcount
+            if blocked:
+                # Заблокировавшие бота больше не получат рассылок
+                cursor.executemany("DELETE FROM users WHERE user_id = ?", [(user_id,) for user_id in blocked])
+        return updated == 1
+
+    def _finish(self, job_id):
+        self.db.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        )
+        self._report(job_id)
+
+    def _report(self, job_id):
+        job = self.get(job_id)
+        logger.info("Рассылка %s: %s", job_id, job["status"], extra={
+            "broadcast_id": job_id, "delivered": job["delivered"], "failed": job["failed"], "blocked": job["blocked"],
+        })
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logger.error("Не удалось отправить отчёт о рассылке %s: %s", job_id, e)
+
+
+def throughput(job):
+    """Сообщений в секунду за время активной отправки."""
+    sent = job["delivered"] + job["failed"] + job["blocked"]
+    return sent / job["elapsed"] if job["elapsed"] else 0.0
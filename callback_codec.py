@@ -0,0 +1,112 @@
+"""Компактные callback-токены вместо строк «fabric_next:{категория}:{смещение}».
+
+Токен — TOKEN_PREFIX и base64url (без «=») от нескольких байт:
+
+    версия формата | отпечаток раскладки | id действия | аргументы (varint)
+
+Аргументы — только целые числа: порядковый номер категории, смещение,
+id товара. Поэтому токен кнопки «Показать ещё» занимает около десятка
+байт вместо кириллического имени категории (callback_data ограничена 64
+байтами), а разбор — это base64 и индекс в списке действий, без split.
+
+Отпечаток раскладки — CRC32 (4 байта) от списков, в которые указывают
+порядковые номера (категории, палитра). Если списки изменились, старые
+кнопки не откроют «соседнюю» категорию: decode() отвергнет их как
+устаревшие (StaleToken), так же как токены другой версии формата.
+
+Действие объявляется парой (имя, границы): на каждый аргумент — верхняя
+граница (не включая) или None, если аргумент не ограничен (id товара,
+смещение). Токен с другим числом аргументов или с номером вне границ
+тоже StaleToken, поэтому обработчик получает ровно столько аргументов,
+сколько объявлено, и номера, которые есть в списках. Список действий
+только дополняется: id действия — его позиция в списке.
+
+Состояние, которое не помещается в несколько чисел, хранится на сервере
+в conversation_state.py (по chat_id); в токене тогда достаточно действия.
+"""
+import base64
+import struct
+import zlib
+
+TOKEN_PREFIX = "~"
+FORMAT_VERSION = 2
+HEADER = struct.Struct(">BIB")  # версия, отпечаток раскладки, id действия
+
+
+class StaleToken(ValueError):
+    """Токен другой версии, от другой раскладки или повреждённый."""
+
+
+def _write_varint(out, value):
+    if value < 0:
+        raise ValueError("аргументы токена — неотрицательные целые")
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varints(data, start):
+    values, value, shift = [], 0, 0
+    for byte in data[start:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value, shift = 0, 0
+    if shift:
+        raise StaleToken("оборванный аргумент")
+    return values
+
+
+class CallbackCodec:
+    """Кодирование действий и целых аргументов в короткие callback_data."""
+
+    def __init__(self, actions, layout=()):
+        self.actions = [name for name, _ in actions]
+        self.bounds = [tuple(bounds) for _, bounds in actions]
+        self._ids = {name: i for i, name in enumerate(self.actions)}
+        self.fingerprint = zlib.crc32("\n".join("|".join(map(str, part)) for part in layout).encode())
+
+    def encode(self, action, *args):
+        action_id = self._ids[action]
+        if not self._fits(action_id, args):
+            raise ValueError(f"аргументы {args} не подходят действию {action}")
+        raw = bytearray(HEADER.pack(FORMAT_VERSION, self.fingerprint, action_id))
+        for arg in args:
+            _write_varint(raw, arg)
+        return TOKEN_PREFIX + base64.urlsafe_b64encode(bytes(raw)).decode().rstrip("=")
+
+    @staticmethod
+    def is_token(data):
+        return bool(data) and data.startswith(TOKEN_PREFIX)
+
+    def decode(self, data):
+        """(действие, [аргументы]); StaleToken, если токен нельзя исполнить."""
+        body = data[len(TOKEN_PREFIX):]
+        try:
+            raw = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+        except (ValueError, TypeError):
+            raise StaleToken("не base64url")
+        if len(raw) < HEADER.size or raw[0] != FORMAT_VERSION:
+            raise StaleToken("другая версия формата")
+        _, fingerprint, action_id = HEADER.unpack_from(raw)
+        if fingerprint != self.fingerprint:
+            raise StaleToken("изменилась раскладка категорий")
+        if action_id >= len(self.actions):
+            raise StaleToken("неизвестное действие")
+        args = _read_varints(raw, HEADER.size)
+        if not self._fits(action_id, args):
+            raise StaleToken("аргументы не подходят действию")
+        return self.actions[action_id], args
+
+    def _fits(self, action_id, args):
+        bounds = self.bounds[action_id]
+        return len(args) == len(bounds) and all(
+            0 <= arg and (bound is None or arg < bound) for arg, bound in zip(args, bounds)
+        )
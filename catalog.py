@@ -0,0 +1,77 @@
+"""Каталог товаров в памяти.
+
+Таблица products маленькая и меняется редко, поэтому она целиком держится
+в памяти: поиск по ключу из callback («details_<key>», «order_<key>») и
+выборка категории — обычные обращения к словарю. Любая запись в products
+должна сопровождаться вызовом invalidate(), после чего каталог
+перечитается при следующем обращении.
+"""
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Product = namedtuple("Product", "id key name description price category image_url")
+
+
+def make_product_key(name):
+    """Короткий стабильный ключ товара для callback_data.
+
+    Совпадает с прежней схемой md5(name)[:8], поэтому кнопки в старых
+    сообщениях продолжают работать.
+    """
+    return hashlib.md5(name.encode()).hexdigest()[:8]
+
+
+class ProductCatalog:
+    """Снимок таблицы products с индексами по ключу, id и категории."""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self.version = 0  # растёт при каждом invalidate(); по нему сбрасываются производные кэши
+
+    def _load(self):
+        rows = self.db.fetchall(
+            "SELECT id, product_key, name, description, price, category, image_url FROM products ORDER BY id"
+        )
+        products = [Product(*row) for row in rows]
+        by_category = {}
+        for product in products:
+            by_category.setdefault(product.category, []).append(product)
+        return {
+            "by_key": {p.key: p for p in products},
+            "by_id": {p.id: p for p in products},
+            "by_category": by_category,
+        }
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                    logger.info("Каталог загружен: %s товаров", len(self._snapshot["by_id"]))
+                snapshot = self._snapshot
+        return snapshot
+
+    def invalidate(self):
+        """Сбрасывает снимок после записи в products."""
+        with self._lock:
+            self._snapshot = None
+            self.version += 1
+
+    def warm(self):
+        self._get_snapshot()
+
+    def get(self, key):
+        return self._get_snapshot()["by_key"].get(key)
+
+    def get_by_id(self, product_id):
+        return self._get_snapshot()["by_id"].get(product_id)
+
+    def in_category(self, category):
+        return self._get_snapshot()["by_category"].get(category, [])
@@ -0,0 +1,171 @@
+"""Состояние диалогов, общее для всех воркеров и реплик.
+
+bot.register_next_step_handler держит «следующий шаг» в памяти процесса:
+при нескольких воркерах gunicorn ответ пользователя попадает в другой
+процесс и теряется, а перезапуск теряет его всегда. Здесь состояние
+хранится по ключу (chat_id, slot) с TTL:
+
+* SQLiteStateStore — по умолчанию: отдельный файл SQLite (своя схема,
+  см. migrations.STATE_MIGRATIONS), перед ним LRU-кэш в памяти. Все
+  запросы хранилища идут через одно соединение, поэтому его PRAGMA
+  data_version меняется только от записей других процессов: тогда кэш
+  сбрасывается, и реплики не видят устаревших данных. Свои записи кэш
+  учитывает сам, и попадание в кэш обходится без чтения таблицы.
+* MemoryStateStore — только память; для одного процесса и тестов.
+
+Значение слота — JSON-совместимый словарь. take() забирает и удаляет
+значение атомарно (DELETE … RETURNING), так что шаг диалога обработает
+ровно один воркер.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import track_db
+
+DEFAULT_TTL = 3600
+
+
+class MemoryStateStore:
+    """LRU-словарь (chat_id, slot) → (данные, срок годности)."""
+
+    def __init__(self, capacity=10000, default_ttl=DEFAULT_TTL):
+        self.capacity = capacity
+        self.default_ttl = default_ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, data, expires_at):
+        self._items[key] = (data, expires_at)
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def _lookup(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        data, expires_at = item
+        if expires_at <= time.time():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return data
+
+    def get(self, chat_id, slot):
+        with self._lock:
+            data = self._lookup((chat_id, slot))
+        return None if data is None else dict(data)
+
+    def set(self, chat_id, slot, data, ttl=None):
+        with self._lock:
+            self._remember((chat_id, slot), dict(data), time.time() + (ttl or self.default_ttl))
+
+    def clear(self, chat_id, slot):
+        with self._lock:
+            self._items.pop((chat_id, slot), None)
+
+    def take(self, chat_id, slot):
+        with self._lock:
+            data = self._lookup((chat_id, slot))
+            self._items.pop((chat_id, slot), None)
+        return data
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """Состояние в SQLite; унаследованный LRU работает как кэш перед базой."""
+
+    PRUNE_EVERY = 1000  # записей между чистками просроченных строк
+
+    def __init__(self, db, capacity=10000, default_ttl=DEFAULT_TTL):
+        super().__init__(capacity, default_ttl)
+        self.db = db
+        self._conn = db.open_connection()  # используется только под self._lock
+        self._data_version = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _query(self, op, sql, params=()):
+        with track_db(op):
+            return self._conn.execute(sql, params).fetchall()
+
+    def _sync(self):
+        """Сбрасывает кэш, если файл базы менял другой процесс (или соединение)."""
+        version = self._query("fetchone", "PRAGMA data_version")[0][0]
+        if self._data_version != version:
+            self._items.clear()
+            self._data_version = version
+
+    def get(self, chat_id, slot):
+        key = (chat_id, slot)
+        with self._lock:
+            self._sync()
+            if key in self._items:
+                self.hits += 1
+                data = self._lookup(key)
+                return None if data is None else dict(data)
+
+            self.misses += 1
+            rows = self._query(
+                "fetchone",
+                "SELECT data, expires_at FROM conversation_state WHERE chat_id = ? AND slot = ? AND expires_at > ?",
+                (chat_id, slot, time.time())
+            )
+            if not rows:
+                # Отсутствие состояния тоже кэшируется — это самый частый ответ
+                self._remember(key, None, float("inf"))
+                return None
+            data = json.loads(rows[0][0])
+            self._remember(key, data, rows[0][1])
+        return dict(data)
+
+    def _lookup(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        data, expires_at = item
+        if expires_at <= time.time():
+            self._items[key] = (None, float("inf"))
+            return None
+        self._items.move_to_end(key)
+        return data
+
+    def set(self, chat_id, slot, data, ttl=None):
+        expires_at = time.time() + (ttl or self.default_ttl)
+        with self._lock:
+            self._sync()  # до записи: чужие изменения после неё сбросят кэш при следующем чтении
+            self._query(
+                "execute",
+                "INSERT OR REPLACE INTO conversation_state (chat_id, slot, data, expires_at) VALUES (?, ?, ?, ?)",
+                (chat_id, slot, json.dumps(data, ensure_ascii=False), expires_at)
+            )
+            self._remember((chat_id, slot), dict(data), expires_at)
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._query("execute", "DELETE FROM conversation_state WHERE expires_at <= ?", (time.time(),))
+
+    def clear(self, chat_id, slot):
+        with self._lock:
+            self._sync()
+            self._query("execute", "DELETE FROM conversation_state WHERE chat_id = ? AND slot = ?", (chat_id, slot))
+            self._remember((chat_id, slot), None, float("inf"))
+
+    def take(self, chat_id, slot):
+        with self._lock:
+            self._sync()
+            # _query дочитывает курсор: иначе DELETE не завершится и не закоммитится
+            rows = self._query(
+                "fetchall",
+                "DELETE FROM conversation_state WHERE chat_id = ? AND slot = ? RETURNING data, expires_at",
+                (chat_id, slot)
+            )
+            self._remember((chat_id, slot), None, float("inf"))
+        if not rows or rows[0][1] <= time.time():
+            return None
+        return json.loads(rows[0][0])
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "cached": len(self._items)}
@@ -0,0 +1,133 @@
+"""Слой доступа к SQLite.
+
+Вместо sqlite3.connect() на каждый запрос у каждого потока есть своё
+долгоживущее соединение. База работает в режиме WAL (читатели не ждут
+писателя), synchronous=NORMAL (fsync только на контрольных точках WAL),
+а busy_timeout заставляет конкурирующих писателей подождать, а не падать
+с «database is locked». Скомпилированные запросы кэширует сам модуль
+sqlite3 (параметр cached_statements), поэтому SQL передаётся
+строками-константами с плейсхолдерами.
+
+Соединение закрывается, когда завершается его поток: под threaded
+Werkzeug каждый HTTP-запрос — новый поток, и без этого соединения и
+файловые дескрипторы копились бы без предела.
+
+Каждый запрос замеряется гистограммой db_query_duration_seconds (см.
+metrics.py); для транзакций отдельно видно ожидание BEGIN IMMEDIATE
+(блокировка писателя) и длительность COMMIT.
+"""
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+from metrics import track_db
+
+
+class _ThreadConnection:
+    """Держатель соединения в threading.local: умирает вместе с потоком."""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _release(connections, lock, conn):
+    with lock:
+        connections.discard(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+class Database:
+    """Пул соединений «по одному на поток» к одному файлу SQLite."""
+
+    def __init__(self, path, busy_timeout_ms=5000, cached_statements=256):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # автокоммит; транзакции — через transaction()
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def open_connection(self):
+        """Отдельное соединение вне «по одному на поток»; закрывается в close_all()."""
+        return self._connect()
+
+    @property
+    def connection(self):
+        """Соединение текущего потока (создаётся при первом обращении, закрывается с потоком)."""
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            conn = self._connect()
+            holder = self._local.holder = _ThreadConnection(conn)
+            finalizer = weakref.finalize(holder, _release, self._connections, self._lock, conn)
+            finalizer.atexit = False  # при выходе соединения закрывает close_all(), после остановки потоков
+        return holder.conn
+
+    def execute(self, sql, params=()):
+        with track_db("execute"):
+            return self.connection.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        with self.transaction() as conn, track_db("executemany"):
+            return conn.executemany(sql, seq_of_params)
+
+    def fetchone(self, sql, params=()):
+        with track_db("fetchone"):
+            return self.connection.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with track_db("fetchall"):
+            return self.connection.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE … COMMIT; при исключении — ROLLBACK.
+
+        Вложенные вызовы выполняются внутри внешней транзакции.
+        """
+        conn = self.connection
+        if conn.in_transaction:
+            yield conn
+            return
+        with track_db("begin"):
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with track_db("commit"):
+            conn.execute("COMMIT")
+
+    def close_all(self):
+        """Закрывает все соединения (при остановке процесса)."""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
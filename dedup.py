@@ -0,0 +1,87 @@
+"""Отсев повторно доставленных апдейтов по update_id.
+
+Если вебхук ответил слишком медленно, Telegram присылает тот же апдейт
+ещё раз — без защиты это дубли заявок, уведомлений и загрузок фото.
+Недавние update_id хранятся в LRU-словаре с TTL; при наличии базы они
+дополнительно пишутся в таблицу seen_updates, поэтому защита работает
+между воркерами gunicorn и переживает перезапуск.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Ограниченный по размеру и времени набор уже принятых update_id."""
+
+    PRUNE_EVERY = 1000  # вставок между чистками таблицы
+
+    def __init__(self, db=None, capacity=10000, ttl=24 * 3600):
+        self.db = db
+        self.capacity = capacity
+        self.ttl = ttl
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.skipped = 0
+
+    def seen(self, update_id):
+        """True, если апдейт уже принимали (его надо пропустить); иначе запоминает его."""
+        now = time.time()
+        with self._lock:
+            seen_at = self._recent.get(update_id)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self._recent.move_to_end(update_id)
+                self.skipped += 1
+                return True
+
+        if self.db is not None and self._claim_in_db(update_id, now) is False:
+            with self._lock:
+                self.skipped += 1
+            return True
+
+        with self._lock:
+            self._recent[update_id] = now
+            self._recent.move_to_end(update_id)
+            while len(self._recent) > self.capacity:
+                self._recent.popitem(last=False)
+        return False
+
+    def forget(self, update_id):
+        """Снимает отметку — например, если апдейт не приняли из-за перегрузки."""
+        with self._lock:
+            self._recent.pop(update_id, None)
+        if self.db is not None:
+            try:
+                self.db.execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+            except sqlite3.Error as e:
+                logger.error("Ошибка удаления update_id %s: %s", update_id, e, extra={"update_id": update_id})
+
+    def _claim_in_db(self, update_id, now):
+        """True — апдейт новый, False — его уже записал другой процесс, None — база недоступна."""
+        try:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)",
+                (update_id, now)
+            )
+            if cursor.rowcount == 0:
+                row = self.db.fetchone("SELECT seen_at FROM seen_updates WHERE update_id = ?", (update_id,))
+                if row and now - row[0] < self.ttl:
+                    return False
+                self.db.execute("UPDATE seen_updates SET seen_at = ? WHERE update_id = ?", (now, update_id))
+
+            self._inserts += 1
+            if self._inserts % self.PRUNE_EVERY == 0:
+                self.db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (now - self.ttl,))
+            return True
+        except sqlite3.Error as e:
+            logger.error("Ошибка записи update_id %s: %s", update_id, e, extra={"update_id": update_id})
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {"skipped": self.skipped, "tracked": len(self._recent)}
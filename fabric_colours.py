@@ -0,0 +1,273 @@
+"""Индекс доминирующих цветов образцов тканей.
+
+Офлайн-этап (как и fabric_derivatives.py) проходит по fabric-samples/*,
+уменьшает каждое изображение до SAMPLE_SIDE px и кластеризует пиксели
+k-means в пространстве CIELAB (векторизованно на NumPy), параллельно в
+пуле процессов. Для каждого образца сохраняются CLUSTERS цветов и их
+доли. Результат — один компактный файл .npz (float16/uint16 массивы);
+при повторном запуске пересчитываются только новые и изменённые файлы.
+
+Запуск:  python fabric_colours.py [--root fabric-samples] [--workers N]
+
+Бот только читает индекс (ColourIndex) и ищет ближайшие по цвету образцы
+без декодирования изображений; ранжирование для каждого цвета палитры
+кэшируется до перечитывания индекса.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fabric_derivatives import DERIVATIVES_DIR, iter_sources
+
+logger = logging.getLogger(__name__)
+
+COLOUR_INDEX_PATH = os.getenv("FABRIC_COLOUR_INDEX", os.path.join(DERIVATIVES_DIR, "colours.npz"))
+
+SAMPLE_SIDE = 64         # сторона уменьшенной копии для кластеризации
+CLUSTERS = 4             # доминирующих цветов на образец
+KMEANS_ITERATIONS = 12
+MIN_CLUSTER_SHARE = 0.1  # кластеры меньше этой доли (шов, тень) при поиске не учитываются
+MAX_DISTANCE = 35.0      # ΔE, дальше которого образец уже «другого цвета»
+MAX_MATCHES = 60
+
+# Палитра кнопок «Подобрать по цвету»: подпись → sRGB
+COLOUR_PALETTE = [
+    ("⚪ Белый", (240, 240, 235)),
+    ("🥛 Бежевый", (222, 205, 175)),
+    ("🩶 Серый", (150, 150, 150)),
+    ("🌫️ Серо-голубой", (140, 160, 180)),
+    ("🔵 Голубой", (140, 190, 225)),
+    ("🟦 Синий", (40, 70, 150)),
+    ("🟢 Зелёный", (90, 150, 90)),
+    ("🟡 Жёлтый", (235, 210, 80)),
+    ("🟠 Оранжевый", (235, 130, 50)),
+    ("🔴 Красный", (190, 40, 45)),
+    ("🌸 Розовый", (235, 165, 180)),
+    ("🟣 Фиолетовый", (130, 90, 160)),
+    ("🟤 Коричневый", (115, 80, 55)),
+    ("⚫ Чёрный", (30, 30, 30)),
+]
+
+
+def rgb_to_lab(rgb):
+    """sRGB (…, 3) в диапазоне 0..255 → CIELAB (D65)."""
+    import numpy as np
+
+    c = np.asarray(rgb, dtype=np.float32) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193],
+                        [0.3576, 0.7152, 0.1192],
+                        [0.1805, 0.0722, 0.9505]], dtype=np.float32)
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def kmeans(points, k=CLUSTERS, iterations=KMEANS_ITERATIONS, seed=0):
+    """k-means++ по точкам (N, 3); возвращает (центры (k, 3), доли (k,)) по убыванию доли."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+    centres = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        d2 = ((points[:, None, :] - np.asarray(centres)[None]) ** 2).sum(-1).min(1)
+        total = d2.sum()
+        index = rng.choice(len(points), p=d2 / total) if total > 0 else rng.integers(len(points))
+        centres.append(points[index])
+    centres = np.asarray(centres, dtype=np.float32)
+
+    for _ in range(iterations):
+        labels = ((points[:, None, :] - centres[None]) ** 2).sum(-1).argmin(1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, labels, points)
+        moved = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centres)
+        if np.allclose(moved, centres, atol=0.05):
+            centres = moved
+            break
+        centres = moved
+
+    labels = ((points[:, None, :] - centres[None]) ** 2).sum(-1).argmin(1)
+    shares = np.bincount(labels, minlength=k) / len(points)
+    order = np.argsort(-shares)
+    return centres[order], shares[order]
+
+
+def _process_source(path):
+    """Выполняется в дочернем процессе: доминирующие цвета одного образца."""
+    import numpy as np
+    from PIL import Image
+
+    st = os.stat(path)
+    with Image.open(path) as source:
+        source.draft("RGB", (SAMPLE_SIDE * 2, SAMPLE_SIDE * 2))  # JPEG декодируется сразу в уменьшенном виде
+        image = source.convert("RGBA")
+        image.thumbnail((SAMPLE_SIDE, SAMPLE_SIDE))
+    pixels = np.asarray(image, dtype=np.float32).reshape(-1, 4)
+    pixels = pixels[pixels[:, 3] > 127, :3]  # прозрачный фон PNG не учитываем
+    if len(pixels) == 0:
+        pixels = np.full((1, 3), 255, dtype=np.float32)
+    centres, shares = kmeans(rgb_to_lab(pixels))
+
+    lab = np.zeros((CLUSTERS, 3), dtype=np.float32)
+    weights = np.zeros(CLUSTERS, dtype=np.float32)
+    lab[:len(centres)], weights[:len(shares)] = centres, shares
+    return path, st.st_size, st.st_mtime_ns, lab, weights
+
+
+def load_index(index_path=COLOUR_INDEX_PATH):
+    """Содержимое индекса: {path: (size, mtime_ns, lab (k, 3), weights (k,))}."""
+    import numpy as np
+
+    try:
+        with np.load(index_path, allow_pickle=False) as data:
+            return {
+                str(path): (int(size), int(mtime), lab.astype(np.float32), weights.astype(np.float32) / 65535)
+                for path, size, mtime, lab, weights in zip(
+                    data["paths"], data["sizes"], data["mtimes"], data["lab"], data["weights"])
+            }
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _write_index(entries, index_path):
+    import numpy as np
+
+    paths = sorted(entries)
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = f"{index_path}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        paths=np.array(paths, dtype=str),
+        sizes=np.array([entries[p][0] for p in paths], dtype=np.int64),
+        mtimes=np.array([entries[p][1] for p in paths], dtype=np.int64),
+        lab=np.array([entries[p][2] for p in paths], dtype=np.float16).reshape(-1, CLUSTERS, 3),
+        weights=np.array([np.round(entries[p][3] * 65535) for p in paths], dtype=np.uint16).reshape(-1, CLUSTERS),
+    )
+    os.replace(tmp_path, index_path)
+
+
+def build_colour_index(root="fabric-samples", index_path=COLOUR_INDEX_PATH, workers=None):
+    """Инкрементально пересчитывает индекс цветов. Возвращает (обработано, пропущено)."""
+    entries = load_index(index_path)
+    sources = list(iter_sources(root, os.path.dirname(index_path) or DERIVATIVES_DIR))
+
+    pending = []
+    for path in sources:
+        entry = entries.get(path)
+        st = os.stat(path)
+        if not (entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns):
+            pending.append(path)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_process_source, path) for path in pending]
+            for future in futures:
+                try:
+                    path, size, mtime_ns, lab, weights = future.result()
+                except Exception as e:
+                    logger.error("Ошибка обработки образца: %s", e)
+                    continue
+                entries[path] = (size, mtime_ns, lab, weights)
+
+    known = set(sources)
+    entries = {path: entry for path, entry in entries.items() if path in known}
+    _write_index(entries, index_path)
+    return len(pending), len(sources) - len(pending)
+
+
+class ColourIndex:
+    """Поиск образцов, ближайших к цвету палитры, по готовому индексу.
+
+    Без NumPy или без файла индекса available() возвращает False, и бот
+    просто не предлагает подбор по цвету.
+    """
+
+    RELOAD_INTERVAL = 30  # секунд между проверками файла индекса
+
+    def __init__(self, index_path=COLOUR_INDEX_PATH):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._paths = []
+        self._lab = None
+        self._weights = None
+        self._rankings = {}
+
+    def load(self):
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            import numpy as np
+        except ImportError:
+            logger.warning("NumPy не установлен — подбор по цвету недоступен")
+            return
+
+        entries = load_index(self.index_path)
+        paths = sorted(entries)
+        with self._lock:
+            self._paths = paths
+            self._lab = np.array([entries[p][2] for p in paths], dtype=np.float32).reshape(-1, CLUSTERS, 3)
+            self._weights = np.array([entries[p][3] for p in paths], dtype=np.float32).reshape(-1, CLUSTERS)
+            self._rankings = {}
+            self._mtime = mtime
+        logger.info("Индекс цветов загружен: %s образцов", len(paths))
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at > self.RELOAD_INTERVAL:
+            self._checked_at = now
+            self.load()
+
+    def available(self):
+        self._maybe_reload()
+        return bool(self._paths)
+
+    def _ranking(self, colour):
+        ranking = self._rankings.get(colour)
+        if ranking is not None:
+            return ranking
+        import numpy as np
+
+        with self._lock:
+            target = rgb_to_lab(COLOUR_PALETTE[colour][1])
+            distance = np.sqrt(((self._lab - target) ** 2).sum(-1))  # ΔE76, (N, k)
+            # Мелкие кластеры не в счёт; крупные выигрывают у второстепенных
+            distance = np.where(self._weights >= MIN_CLUSTER_SHARE, distance * (2 - self._weights), np.inf)
+            best = distance.min(1)
+            order = np.argsort(best, kind="stable")
+            ranking = [self._paths[i] for i in order[:MAX_MATCHES] if best[i] <= MAX_DISTANCE]
+            self._rankings[colour] = ranking
+        return ranking
+
+    def nearest(self, colour, offset=0, limit=10):
+        """Пути образцов, ближайших к COLOUR_PALETTE[colour], и их общее число."""
+        self._maybe_reload()
+        if not self._paths:
+            return [], 0
+        ranking = self._ranking(colour)
+        return ranking[offset:offset + limit], len(ranking)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Индекс доминирующих цветов образцов тканей")
+    parser.add_argument("--root", default="fabric-samples", help="папка с образцами")
+    parser.add_argument("--index-path", default=COLOUR_INDEX_PATH, help="файл индекса (.npz)")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — все ядра)")
+    args = parser.parse_args()
+
+    from log_config import configure_logging
+    configure_logging()
+
+    started = time.time()
+    processed, skipped = build_colour_index(args.root, args.index_path, args.workers)
+    logger.info("Обработано: %s, без изменений: %s, за %.1f с", processed, skipped, time.time() - started)
@@ -0,0 +1,236 @@
+"""Подготовка облегчённых копий образцов тканей для Telegram.
+
+Исходники в fabric-samples/* — полноразмерные снимки весом до нескольких
+мегабайт. Этот модуль заранее (офлайн) делает из них:
+
+* JPEG для показа — не больше DISPLAY_MAX_SIDE по длинной стороне;
+* миниатюру — не больше THUMB_MAX_SIDE.
+
+Копии лежат в DERIVATIVES_DIR и называются по SHA-256 исходника, поэтому
+переименование файла не требует пересчёта. Манифест (путь → размер, mtime,
+хэш) позволяет при повторном запуске обрабатывать только новые и
+изменённые файлы.
+
+Запуск:  python fabric_derivatives.py [--root fabric-samples] [--workers N]
+
+Бот читает только манифест (Pillow ему не нужен) и подменяет путь к
+исходнику на путь к копии через DerivativeStore.resolve().
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from file_id_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = os.getenv("FABRIC_DERIVATIVES_DIR", ".cache/fabric")
+MANIFEST_NAME = "manifest.json"
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Telegram всё равно ужимает фото до 1280 px, а миниатюры — до 320 px
+DISPLAY_MAX_SIDE = 1280
+DISPLAY_QUALITY = 85
+THUMB_MAX_SIDE = 320
+THUMB_QUALITY = 80
+
+
+def derivative_paths(sha256, cache_dir=DERIVATIVES_DIR):
+    """Пути к копии для показа и к миниатюре для исходника с данным хэшем."""
+    base = os.path.join(cache_dir, sha256[:2], sha256)
+    return f"{base}.jpg", f"{base}_thumb.jpg"
+
+
+def iter_sources(root, cache_dir=DERIVATIVES_DIR):
+    """Все изображения образцов внутри root, в стабильном порядке."""
+    skip = os.path.abspath(cache_dir)
+    for folder, _, files in sorted(os.walk(root)):
+        if os.path.abspath(folder).startswith(skip):
+            continue
+        for filename in sorted(files):
+            if filename.lower().endswith(SOURCE_EXTENSIONS):
+                yield os.path.join(folder, filename)
+
+
+def _save_jpeg(image, max_side, quality, target):
+    from PIL import Image
+
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp"
+    image.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_path, target)
+
+
+def _process_source(path, cache_dir):
+    """Выполняется в дочернем процессе: хэширует исходник и строит копии."""
+    from PIL import Image, ImageOps
+
+    st = os.stat(path)
+    sha256 = file_sha256(path)
+    display_path, thumb_path = derivative_paths(sha256, cache_dir)
+
+    if not (os.path.exists(display_path) and os.path.exists(thumb_path)):
+        with Image.open(path) as source:
+            image = ImageOps.exif_transpose(source)
+            if image.mode != "RGB":
+                # PNG с прозрачностью кладём на белый фон
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                rgba = image.convert("RGBA")
+                background.paste(rgba, mask=rgba.split()[-1])
+                image = background
+            _save_jpeg(image, DISPLAY_MAX_SIDE, DISPLAY_QUALITY, display_path)
+            _save_jpeg(image, THUMB_MAX_SIDE, THUMB_QUALITY, thumb_path)
+
+    # Копия имеет смысл, только если она легче исходника (или исходник — PNG)
+    use_display = (
+        os.path.getsize(display_path) < st.st_size
+        or not path.lower().endswith(('.jpg', '.jpeg'))
+    )
+    return path, {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": sha256,
+        "display": use_display,
+    }
+
+
+def load_manifest(cache_dir=DERIVATIVES_DIR):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(manifest, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    target = os.path.join(cache_dir, MANIFEST_NAME)
+    tmp_path = f"{target}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=0, sort_keys=True)
+    os.replace(tmp_path, target)
+
+
+def build_derivatives(root="fabric-samples", cache_dir=DERIVATIVES_DIR, workers=None):
+    """Инкрементально строит копии для всех образцов в root.
+
+    Возвращает (обработано, пропущено без изменений).
+    """
+    manifest = load_manifest(cache_dir)
+    sources = list(iter_sources(root, cache_dir))
+
+    pending = []
+    for path in sources:
+        entry = manifest.get(path)
+        st = os.stat(path)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            display_path, thumb_path = derivative_paths(entry["sha256"], cache_dir)
+            if os.path.exists(display_path) and os.path.exists(thumb_path):
+                continue
+        pending.append(path)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_process_source, path, cache_dir) for path in pending]
+            for future in futures:
+                try:
+                    path, entry = future.result()
+                except Exception as e:
+                    logger.error("Ошибка обработки образца: %s", e)
+                    continue
+                manifest[path] = entry
+
+    # Удалённые исходники убираем из манифеста
+    known = set(sources)
+    for path in list(manifest):
+        if path not in known:
+            del manifest[path]
+
+    _write_manifest(manifest, cache_dir)
+    return len(pending), len(sources) - len(pending)
+
+
+class DerivativeStore:
+    """Подменяет путь к исходнику на путь к заранее подготовленной копии.
+
+    Если копии нет или исходник изменился после подготовки, возвращается
+    исходный путь — бот продолжает работать и без офлайн-этапа.
+    """
+
+    RELOAD_INTERVAL = 30  # секунд между проверками манифеста на диске
+
+    def __init__(self, cache_dir=DERIVATIVES_DIR):
+        self.cache_dir = cache_dir
+        self._manifest = {}
+        self._manifest_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._reload()
+
+    def _reload(self):
+        manifest_path = os.path.join(self.cache_dir, MANIFEST_NAME)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._manifest_mtime:
+            self._manifest = load_manifest(self.cache_dir)
+            self._manifest_mtime = mtime
+            logger.info("Загружен манифест копий: %s образцов", len(self._manifest))
+
+    def _entry(self, path):
+        now = time.monotonic()
+        if now - self._checked_at > self.RELOAD_INTERVAL:
+            with self._lock:
+                if now - self._checked_at > self.RELOAD_INTERVAL:
+                    self._checked_at = now
+                    self._reload()
+
+        entry = self._manifest.get(path)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            return None
+        return entry
+
+    def resolve(self, path):
+        """Путь к файлу, который стоит отправить вместо path."""
+        entry = self._entry(path)
+        if entry is None or not entry.get("display"):
+            return path
+        display_path, _ = derivative_paths(entry["sha256"], self.cache_dir)
+        return display_path if os.path.exists(display_path) else path
+
+    def thumbnail(self, path):
+        """Путь к миниатюре или None, если её ещё не построили."""
+        entry = self._entry(path)
+        if entry is None:
+            return None
+        _, thumb_path = derivative_paths(entry["sha256"], self.cache_dir)
+        return thumb_path if os.path.exists(thumb_path) else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Подготовка облегчённых копий образцов тканей")
+    parser.add_argument("--root", default="fabric-samples", help="папка с образцами")
+    parser.add_argument("--cache-dir", default=DERIVATIVES_DIR, help="куда складывать копии")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — все ядра)")
+    args = parser.parse_args()
+
+    from log_config import configure_logging
+    configure_logging()
+
+    started = time.time()
+    processed, skipped = build_derivatives(args.root, args.cache_dir, args.workers)
+    logger.info("Обработано: %s, без изменений: %s, за %.1f с", processed, skipped, time.time() - started)
@@ -0,0 +1,142 @@
+"""Индекс образцов тканей в памяти.
+
+Папки fabric-samples/* сканируются один раз при старте: для каждой
+категории хранится заранее отсортированный список образцов, и страница
+«Показать ещё» — это просто срез списка. Папки перечитываются, только
+если изменился их mtime (проверка не чаще раза в REFRESH_INTERVAL секунд).
+Счётчик version растёт при каждом пересканировании папки; по нему
+перестраиваются производные индексы (см. fabric_search.py).
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from fabric_derivatives import SOURCE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# Категория в меню → папка внутри fabric-samples (порядок = порядок кнопок)
+FABRIC_CATEGORIES = {
+    "зебра": "zebra",
+    "рулонка": "rulonka",
+    "плиссе": "plisse",
+    "вертикальные": "vertikalnye",
+    "вертикальные пластик": "vertikalnye_plastik",
+    "дерево50": "derevo50",
+    "дерево25мм": "derevo25mm",
+    "алюминий25мм": "alyuminij25mm"
+}
+
+FabricEntry = namedtuple("FabricEntry", "ordinal path name size")
+
+
+def parse_article_name(filename):
+    """Название ткани из имени файла: «АЖУР-0225-белый,-220-см.jpg» → «Ажур-0225-Белый,-220-См»."""
+    name = os.path.splitext(filename)[0]
+    return name.replace("_", " ").title()
+
+
+class FabricIndex:
+    """Отсортированные списки образцов по категориям."""
+
+    REFRESH_INTERVAL = 10  # секунд между проверками mtime папок
+
+    def __init__(self, root="fabric-samples", categories=FABRIC_CATEGORIES):
+        self.root = root
+        self.categories = dict(categories)
+        self.missing = []
+        self._entries = {}
+        self._by_path = {}
+        self._mtimes = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def load(self):
+        """Полное сканирование; отсутствующие папки сообщаются один раз здесь."""
+        with self._lock:
+            self.missing = []
+            for category, folder in self.categories.items():
+                path = os.path.join(self.root, folder)
+                if not os.path.isdir(path):
+                    self.missing.append(category)
+                    continue
+                self._scan(category, path)
+            self._checked_at = time.monotonic()
+
+        total = sum(len(entries) for entries in self._entries.values())
+        logger.info("Индекс образцов построен: %s файлов в %s категориях", total, len(self._entries))
+        if self.missing:
+            logger.warning("Нет папок для категорий: %s", ", ".join(self.missing))
+
+    def _scan(self, category, path):
+        mtime = os.stat(path).st_mtime_ns
+        filenames = sorted(f for f in os.listdir(path) if f.lower().endswith(SOURCE_EXTENSIONS))
+        entries = []
+        for ordinal, filename in enumerate(filenames):
+            file_path = f"{path}/{filename}"
+            entries.append(FabricEntry(ordinal, file_path, parse_article_name(filename), os.path.getsize(file_path)))
+        for old in self._entries.get(category, ()):
+            self._by_path.pop(old.path, None)
+        self._entries[category] = entries
+        self._by_path.update((entry.path, (category, entry)) for entry in entries)
+        self._mtimes[category] = mtime
+        self.version += 1
+
+    def _drop(self, category):
+        """Убирает из индекса категорию, чья папка пропала; вернётся через missing."""
+        for old in self._entries.pop(category, ()):
+            self._by_path.pop(old.path, None)
+        self._mtimes.pop(category, None)
+        self.missing.append(category)
+        self.version += 1
+        logger.warning("Папка '%s' пропала, категория убрана из индекса", category)
+
+    def refresh(self):
+        """Перечитывает папки, у которых изменился mtime, появившиеся и пропавшие папки."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            for category, folder in self.categories.items():
+                path = os.path.join(self.root, folder)
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if category in self.missing:
+                    if mtime is None or not os.path.isdir(path):
+                        continue
+                    self._scan(category, path)
+                    self.missing.remove(category)
+                    logger.info("Появилась папка '%s', категория добавлена в индекс", category)
+                elif mtime is None or not os.path.isdir(path):
+                    self._drop(category)
+                elif mtime != self._mtimes.get(category):
+                    self._scan(category, path)
+                    logger.info("Папка '%s' изменилась, индекс обновлён", category)
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._checked_at > self.REFRESH_INTERVAL:
+            self.refresh()
+
+    def has_folder(self, category):
+        self._maybe_refresh()
+        return category in self._entries
+
+    def total(self, category):
+        return len(self._entries.get(category, ()))
+
+    def all_entries(self):
+        """Все образцы всех категорий: (категория, FabricEntry) в порядке кнопок."""
+        for category in self.categories:
+            for entry in self._entries.get(category, ()):
+                yield category, entry
+
+    def entry_for(self, path):
+        """(категория, FabricEntry) для пути образца или None."""
+        return self._by_path.get(path)
+
+    def page(self, category, offset, size):
+        """Срез образцов категории: entries[offset:offset + size]."""
+        return self._entries.get(category, [])[offset:offset + size]
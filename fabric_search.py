@@ -0,0 +1,158 @@
+"""Поиск образцов тканей по коллекции, артикулу, цвету и ширине.
+
+Имена файлов образцов устроены одинаково: «СТАНДАРТ-1852-серый,-5,4м»,
+«МРАМОР-2-5173-голубой,-5,4м», «зебра-АУРА-0225-белый,-300-см».
+parse_fabric_name() разбирает их на коллекцию, четырёхзначный артикул,
+цвет и ширину. FabricSearchIndex строит по всем образцам два индекса:
+
+* токен → образцы (точное совпадение слова или артикула);
+* триграмма → токены словаря (опечатки и части слов: «мрамр», «голуб»).
+
+Нормализация — нижний регистр и «ё» → «е», поэтому «ШЁЛК» находится по
+«шелк». Индекс строится при старте и перестраивается, только когда
+меняется FabricIndex (по его version), так что поиск — это несколько
+обращений к словарям без чтения диска.
+"""
+import os
+import re
+import threading
+from collections import namedtuple
+
+FabricArticle = namedtuple("FabricArticle", "collection article colour width")
+SearchHit = namedtuple("SearchHit", "category entry article score")
+
+# Похожесть токена по триграммам, ниже которой он не считается совпадением
+MIN_SIMILARITY = 0.34
+
+_CATEGORY_PREFIX = re.compile(r"^з?ебра[-\s]+", re.IGNORECASE)
+_ARTICLE = re.compile(r"(?:^|[-\s])(\d{4})(?=$|[-\s,])")
+_WIDTH = re.compile(r"[,\s-]*(\d+(?:[.,]\d+)?)\s*-?\s*(см|cм|cm|мм|м)?\s*$", re.IGNORECASE)
+_UNITS = {"см": "см", "cм": "см", "cm": "см", "мм": "мм", "м": "м"}
+_TOKEN = re.compile(r"[0-9a-zа-я]+(?:[.,][0-9]+)?")
+
+
+def normalize(text):
+    """Нижний регистр, «ё» → «е»."""
+    return text.lower().replace("ё", "е")
+
+
+def tokenize(text):
+    return _TOKEN.findall(normalize(text))
+
+
+def trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _clean_colour(text):
+    """«св.-бежевый» → «св. бежевый»; дефис между буквами («темно-коричневый») остаётся."""
+    chars = list(text)
+    for i, char in enumerate(chars):
+        if char == "-" and not (0 < i < len(chars) - 1 and chars[i - 1].isalpha() and chars[i + 1].isalpha()):
+            chars[i] = " "
+    return re.sub(r"\s+", " ", "".join(chars)).strip(" ,")
+
+
+def parse_fabric_name(filename):
+    """«СТАНДАРТ-1852-серый,-5,4м.jpg» → FabricArticle('СТАНДАРТ', '1852', 'серый', '5,4 м').
+
+    Части, которые не удалось распознать, остаются пустыми строками.
+    """
+    stem = _CATEGORY_PREFIX.sub("", os.path.splitext(os.path.basename(filename))[0]).strip()
+    match = _ARTICLE.search(stem)
+    if match is None:
+        return FabricArticle(re.sub(r"[-\s]+", " ", stem).strip(), "", "", "")
+
+    collection = re.sub(r"[-\s]+", " ", stem[:match.start()]).strip()
+    rest = stem[match.end():]
+    width = ""
+    width_match = _WIDTH.search(rest)
+    if width_match and (width_match.group(2) or width_match.start() > 0):
+        unit = _UNITS.get((width_match.group(2) or "см").lower(), "см")
+        width = f"{width_match.group(1)} {unit}"
+        rest = rest[:width_match.start()]
+    return FabricArticle(collection, match.group(1), _clean_colour(rest), width)
+
+
+class FabricSearchIndex:
+    """Токенный и триграммный индекс по образцам FabricIndex."""
+
+    def __init__(self, fabric_index):
+        self.fabric_index = fabric_index
+        self._lock = threading.Lock()
+        self._version = None
+        self._docs = []
+        self._postings = {}
+        self._trigrams = {}
+
+    def _build(self):
+        docs, postings, trigram_index = [], {}, {}
+        for category, entry in self.fabric_index.all_entries():
+            article = parse_fabric_name(entry.path)
+            doc_id = len(docs)
+            docs.append((category, entry, article))
+            text = " ".join((category, article.collection, article.article, article.colour, article.width))
+            for token in tokenize(text):
+                postings.setdefault(token, set()).add(doc_id)
+        for token in postings:
+            for gram in trigrams(token):
+                trigram_index.setdefault(gram, set()).add(token)
+        return docs, postings, trigram_index
+
+    def _snapshot(self):
+        version = self.fabric_index.version
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._docs, self._postings, self._trigrams = self._build()
+                    self._version = version
+        return self._docs, self._postings, self._trigrams
+
+    def warm(self):
+        self._snapshot()
+
+    def __len__(self):
+        return len(self._snapshot()[0])
+
+    def _similar_tokens(self, token, postings, trigram_index):
+        """Токены словаря, похожие на token: {токен: похожесть 0..1}."""
+        if token in postings:
+            return {token: 1.0}
+        matches = {t: 0.9 for t in postings if t.startswith(token)} if len(token) >= 2 else {}
+        grams = trigrams(token)
+        shared = {}
+        for gram in grams:
+            for candidate in trigram_index.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams(candidate)) - count)
+            if similarity >= MIN_SIMILARITY and similarity > matches.get(candidate, 0):
+                matches[candidate] = similarity
+        return matches
+
+    def search(self, query, limit=None):
+        """Образцы, подходящие под все слова запроса, лучшие первыми."""
+        docs, postings, trigram_index = self._snapshot()
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+
+        scores = None
+        for token in query_tokens:
+            token_scores = {}
+            for candidate, similarity in self._similar_tokens(token, postings, trigram_index).items():
+                for doc_id in postings[candidate]:
+                    if similarity > token_scores.get(doc_id, 0):
+                        token_scores[doc_id] = similarity
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: score + token_scores[doc_id] for doc_id, score in scores.items() if doc_id in token_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [SearchHit(*docs[doc_id], score) for doc_id, score in ranked]
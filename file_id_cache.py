@@ -0,0 +1,198 @@
+"""Кэш Telegram file_id для локальных фотографий.
+
+При первой отправке файл загружается в Telegram, и мы запоминаем file_id,
+который вернул сервер. Дальше фото отправляется по file_id, без повторной
+загрузки байтов. Запись привязана к пути, размеру, mtime и хэшу содержимого:
+если файл изменился, старый file_id отбрасывается.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import ExitStack
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает в альбом от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+
+# Описания ошибок, которыми Telegram отвечает именно на «протухший» file_id.
+# Общие «file_id» или «temporarily unavailable» сюда не входят: такие 400
+# (сбой у Telegram, ошибка в подписи) повторная загрузка не исправит.
+_STALE_FILE_ID_HINTS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+)
+
+
+def file_sha256(path):
+    """Считает SHA-256 содержимого файла блоками."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_stale_file_id_error(error):
+    """Проверяет, что Telegram отклонил именно file_id, а не сам запрос."""
+    if not isinstance(error, ApiTelegramException) or error.error_code != 400:
+        return False
+    description = (error.description or "").lower()
+    return any(hint in description for hint in _STALE_FILE_ID_HINTS)
+
+
+class FileIdCache:
+    """Соответствие «локальный файл → file_id» в SQLite с копией в памяти."""
+
+    def __init__(self, db):
+        self.db = db
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Возвращает file_id для файла или None, если его нужно загрузить."""
+        st = os.stat(path)
+        with self._lock:
+            entry = self._memo.get(path)
+        if entry is None:
+            entry = self._load(path)
+            if entry is None:
+                return None
+
+        size, mtime_ns, sha256, file_id = entry
+        if size == st.st_size and mtime_ns == st.st_mtime_ns:
+            return file_id
+
+        # Метаданные поменялись (копирование, touch) — сверяем содержимое
+        if size == st.st_size and file_sha256(path) == sha256:
+            self._save(path, st.st_size, st.st_mtime_ns, sha256, file_id)
+            return file_id
+
+        self.invalidate(path)
+        return None
+
+    def store(self, path, file_id):
+        """Запоминает file_id, полученный после загрузки файла."""
+        st = os.stat(path)
+        self._save(path, st.st_size, st.st_mtime_ns, file_sha256(path), file_id)
+
+    def invalidate(self, path):
+        with self._lock:
+            self._memo.pop(path, None)
+        try:
+            self.db.execute("DELETE FROM photo_file_ids WHERE path = ?", (path,))
+        except sqlite3.Error as e:
+            logger.error("Ошибка удаления file_id для %s: %s", path, e)
+
+    def _load(self, path):
+        try:
+            row = self.db.fetchone(
+                "SELECT size, mtime_ns, sha256, file_id FROM photo_file_ids WHERE path = ?",
+                (path,)
+            )
+        except sqlite3.Error as e:
+            logger.error("Ошибка чтения кэша file_id: %s", e)
+            return None
+        if row is None:
+            return None
+        entry = tuple(row)
+        with self._lock:
+            self._memo[path] = entry
+        return entry
+
+    def _save(self, path, size, mtime_ns, sha256, file_id):
+        with self._lock:
+            self._memo[path] = (size, mtime_ns, sha256, file_id)
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO photo_file_ids (path, size, mtime_ns, sha256, file_id) VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, sha256, file_id)
+            )
+        except sqlite3.Error as e:
+            logger.error("Ошибка сохранения file_id для %s: %s", path, e)
+
+
+def send_cached_photo(bot, cache, chat_id, path, **kwargs):
+    """Отправляет локальное фото, по возможности через закэшированный file_id.
+
+    Если Telegram отклонил сохранённый file_id, запись сбрасывается и файл
+    загружается заново.
+    """
+    file_id = cache.get(path)
+    if file_id:
+        try:
+            return bot.send_photo(chat_id, file_id, **kwargs)
+        except ApiTelegramException as e:
+            if not is_stale_file_id_error(e):
+                raise
+            logger.warning("Telegram отклонил file_id для %s, загружаем заново: %s", path, e)
+            cache.invalidate(path)
+
+    with open(path, 'rb') as photo:
+        message = bot.send_photo(chat_id, photo, **kwargs)
+    if message.photo:
+        cache.store(path, message.photo[-1].file_id)
+    return message
+
+
+def send_cached_album(bot, cache, chat_id, items):
+    """Отправляет фото одним альбомом (send_media_group) вместо серии send_photo.
+
+    items — список кортежей (path, caption, parse_mode). Файлы с известным
+    file_id уходят по ссылке, остальные загружаются, и их file_id сохраняются.
+    Если альбом целиком отклонён, фото досылаются по одному. Возвращает
+    список путей, которые так и не удалось отправить.
+    """
+    failed = []
+    for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+        chunk = items[start:start + MEDIA_GROUP_LIMIT]
+        if len(chunk) == 1:
+            failed.extend(_send_one_by_one(bot, cache, chat_id, chunk))
+            continue
+
+        with ExitStack() as stack:
+            media, sent = [], []
+            for path, caption, parse_mode in chunk:
+                try:
+                    file_id = cache.get(path)
+                    photo = file_id or stack.enter_context(open(path, 'rb'))
+                except OSError as e:
+                    logger.error("Не удалось открыть %s: %s", path, e)
+                    failed.append(path)
+                    continue
+                media.append(types.InputMediaPhoto(photo, caption=caption, parse_mode=parse_mode))
+                sent.append((path, caption, parse_mode, file_id))
+
+            if len(sent) < 2:
+                failed.extend(_send_one_by_one(bot, cache, chat_id, [item[:3] for item in sent]))
+                continue
+
+            try:
+                messages = bot.send_media_group(chat_id, media)
+            except Exception as e:
+                logger.warning("Альбом не отправлен, шлём фото по одному: %s", e, extra={"chat_id": chat_id})
+                failed.extend(_send_one_by_one(bot, cache, chat_id, [item[:3] for item in sent]))
+                continue
+
+        for (path, _, _, file_id), message in zip(sent, messages):
+            if not file_id and message.photo:
+                cache.store(path, message.photo[-1].file_id)
+    return failed
+
+
+def _send_one_by_one(bot, cache, chat_id, items):
+    failed = []
+    for path, caption, parse_mode in items:
+        try:
+            send_cached_photo(bot, cache, chat_id, path, caption=caption, parse_mode=parse_mode)
+        except Exception as e:
+            logger.error("Ошибка отправки %s: %s", path, e, extra={"chat_id": chat_id})
+            failed.append(path)
+    return failed
@@ -0,0 +1,93 @@
+"""Ограничение частоты действий одного пользователя.
+
+У каждого пользователя свой токен-бакет (rate токенов в секунду, запас
+burst). Действие списывает из него свою стоимость: кнопка меню — 1,
+страница из 10 фото — 10 (стоимость задаётся при регистрации обработчика
+в роутере, см. router.UpdateRouter). Если токенов не хватает, обработчик
+не вызывается: пользователь получает «подождите» в answer_callback_query,
+а воркер тут же свободен для других чатов.
+
+Повторные нажатия той же кнопки схлопываются: пока страница грузится и
+ещё grace секунд после этого, такой же callback (тот же чат, сообщение и
+data) не выполняется. Апдейты одного чата обрабатываются по очереди (см.
+update_workers.py), поэтому двойное нажатие приходит сразу после первого
+и попадает в это окно.
+
+Состояние хранится в памяти процесса (LRU на capacity пользователей);
+с несколькими процессами лимит действует в каждом отдельно.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from send_scheduler import TokenBucket
+
+
+class FloodControl:
+    """Бакеты пользователей и окно схлопывания повторных нажатий."""
+
+    def __init__(self, rate=2.0, burst=40.0, grace=1.5, capacity=10000):
+        self.rate = rate
+        self.burst = burst
+        self.grace = grace
+        self.capacity = capacity
+        self._buckets = OrderedDict()
+        self._in_flight = set()
+        self._finished = OrderedDict()  # ключ → время окончания обработки
+        self._warned = {}
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "throttled": 0, "collapsed": 0}
+
+    def acquire(self, user_id, cost=1):
+        """0, если действие разрешено (стоимость списана); иначе — сколько секунд подождать."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.capacity:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(user_id)
+            wait = bucket.try_take(now, min(cost, self.burst))
+            self._stats["throttled" if wait else "admitted"] += 1
+        return wait
+
+    def should_warn(self, user_id, wait):
+        """True один раз за период ожидания: чтобы не отвечать на каждое лишнее сообщение."""
+        now = time.monotonic()
+        with self._lock:
+            if self._warned.get(user_id, 0) > now:
+                return False
+            self._warned[user_id] = now + wait
+            if len(self._warned) > self.capacity:
+                self._warned = {key: until for key, until in self._warned.items() if until > now}
+        return True
+
+    def begin(self, key):
+        """Начало обработки нажатия; False — такое же нажатие ещё грузится или только что выполнено."""
+        now = time.monotonic()
+        with self._lock:
+            finished = self._finished.get(key)
+            if key in self._in_flight or (finished is not None and now - finished < self.grace):
+                self._stats["collapsed"] += 1
+                return False
+            self._in_flight.add(key)
+        return True
+
+    def end(self, key, completed=True):
+        """Конец обработки; completed=False (действие не выполнялось) не открывает окно схлопывания."""
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight.discard(key)
+            if completed:
+                self._finished[key] = now
+                self._finished.move_to_end(key)
+            while self._finished:
+                oldest_key, finished = next(iter(self._finished.items()))
+                if now - finished < self.grace and len(self._finished) <= self.capacity:
+                    break
+                del self._finished[oldest_key]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, users=len(self._buckets))
@@ -0,0 +1,182 @@
+"""Заранее собранные клавиатуры и карточки каталога.
+
+Клавиатуры меню одинаковы для всех пользователей, поэтому они собираются
+и сериализуются в JSON один раз при импорте: telebot передаёт строку в
+reply_markup как есть, без построения объектов на каждый запрос.
+Карточки товаров (подпись + клавиатура) собираются для категории один
+раз и пересобираются, только когда меняется каталог товаров.
+
+callback_data кнопок — компактные токены CODEC (см. callback_codec.py):
+категории передаются порядковым номером, товары — id.
+"""
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from telebot import types
+
+from callback_codec import CallbackCodec
+from fabric_colours import COLOUR_PALETTE
+from fabric_index import FABRIC_CATEGORIES
+
+WHATSAPP_URL = "https://wa.me/79378222906"
+TELEGRAM_MANAGER_URL = "https://t.me/astra_jalyzi30"
+
+CATALOG_CATEGORIES = [
+    ("🧵 Рулонные шторы", "Рулонные шторы"),
+    ("🪟 Горизонтальные жалюзи", "Горизонтальные жалюзи"),
+    ("🚪 Вертикальные жалюзи", "Вертикальные жалюзи"),
+    ("🌀 Жалюзи плиссе", "Жалюзи плиссе"),
+    ("🪵 Деревянные жалюзи", "Деревянные жалюзи"),
+]
+
+ProductCard = namedtuple("ProductCard", "name image_url caption markup")
+
+FABRIC_CATEGORY_NAMES = list(FABRIC_CATEGORIES)
+FABRIC_CATEGORY_ORDINALS = {name: i for i, name in enumerate(FABRIC_CATEGORY_NAMES)}
+
+# Действия callback-токенов и границы их аргументов (None — без границы);
+# список только дополняется (id — позиция)
+CALLBACK_ACTIONS = [
+    ("catalog_category", (len(CATALOG_CATEGORIES),)),            # номер в CATALOG_CATEGORIES
+    ("fabric_category", (len(FABRIC_CATEGORY_NAMES),)),          # номер в FABRIC_CATEGORIES
+    ("fabric_page", (len(FABRIC_CATEGORY_NAMES), None)),         # категория, смещение
+    ("colour", (len(COLOUR_PALETTE),)),                          # номер цвета в COLOUR_PALETTE
+    ("colour_page", (len(COLOUR_PALETTE), None)),                # цвет, смещение
+    ("product_details", (None,)),                                # id товара
+    ("product_order", (None,)),                                  # id товара
+]
+CODEC = CallbackCodec(CALLBACK_ACTIONS, layout=(
+    [category for _, category in CATALOG_CATEGORIES],
+    FABRIC_CATEGORY_NAMES,
+    [label for label, _ in COLOUR_PALETTE],
+))
+
+
+def _main_menu():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    markup.add("📚 Каталог", "🧵 Ткани")
+    markup.add("🔗 Канал", "📞 Контакты")
+    markup.add("💬 WhatsApp", "ℹ️ Помощь")
+    return markup
+
+
+def _catalog():
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for i, (title, _) in enumerate(CATALOG_CATEGORIES):
+        markup.add(types.InlineKeyboardButton(title, callback_data=CODEC.encode("catalog_category", i)))
+    markup.add(types.InlineKeyboardButton("💬 Написать в WhatsApp", url=WHATSAPP_URL))
+    markup.add(types.InlineKeyboardButton("📞 Заказать звонок", callback_data="request_call"))
+    return markup
+
+
+def _fabric_categories():
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(*[types.InlineKeyboardButton(cat, callback_data=CODEC.encode("fabric_category", i))
+                 for i, cat in enumerate(FABRIC_CATEGORY_NAMES)])
+    markup.row(types.InlineKeyboardButton("🎨 Подобрать по цвету", callback_data="fabric_colour"))
+    return markup
+
+
+def _colour_picker():
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(*[types.InlineKeyboardButton(label, callback_data=CODEC.encode("colour", i))
+                 for i, (label, _) in enumerate(COLOUR_PALETTE)])
+    return markup
+
+
+def _contact_us():
+    return types.InlineKeyboardMarkup([
+        [types.InlineKeyboardButton("💬 Написать в WhatsApp", url=WHATSAPP_URL)],
+        [types.InlineKeyboardButton("✉️ Написать в Telegram", url=TELEGRAM_MANAGER_URL)]
+    ])
+
+
+def _whatsapp():
+    return types.InlineKeyboardMarkup([[types.InlineKeyboardButton("📲 Открыть чат", url=WHATSAPP_URL)]])
+
+
+def _request_phone():
+    return types.ReplyKeyboardMarkup(
+        row_width=1,
+        resize_keyboard=True,
+        one_time_keyboard=True
+    ).add(
+        types.KeyboardButton("📲 Отправить мой номер", request_contact=True)
+    )
+
+
+# === Статические клавиатуры в виде готового JSON ===
+MAIN_MENU = _main_menu().to_json()
+CATALOG = _catalog().to_json()
+FABRIC_CATEGORIES_MENU = _fabric_categories().to_json()
+COLOUR_PICKER = _colour_picker().to_json()
+CONTACT_US = _contact_us().to_json()
+WHATSAPP = _whatsapp().to_json()
+REQUEST_PHONE = _request_phone().to_json()
+REMOVE_KEYBOARD = types.ReplyKeyboardRemove().to_json()
+
+
+@lru_cache(maxsize=1024)
+def show_more(callback_data):
+    """Кнопка «Показать ещё» для страницы образцов."""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("➡️ Показать ещё", callback_data=callback_data))
+    return markup.to_json()
+
+
+@lru_cache(maxsize=1024)
+def search_more(query):
+    """Кнопка, открывающая inline-поиск по тому же запросу в текущем чате."""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🔎 Все результаты с фото", switch_inline_query_current_chat=query))
+    return markup.to_json()
+
+
+def broadcast_confirm(job_id):
+    """Подтверждение рассылки менеджером."""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton("✅ Отправить всем", callback_data=f"broadcast:start:{job_id}"),
+        types.InlineKeyboardButton("❌ Отмена", callback_data=f"broadcast:cancel:{job_id}")
+    )
+    return markup.to_json()
+
+
+def broadcast_running(job_id):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("⏹ Остановить рассылку", callback_data=f"broadcast:cancel:{job_id}"))
+    return markup.to_json()
+
+
+class ProductCardCache:
+    """Карточки товаров по категориям; сбрасываются вместе с каталогом."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._version = None
+        self._cards = {}
+
+    def _render(self, product):
+        markup = types.InlineKeyboardMarkup()
+        markup.add(
+            types.InlineKeyboardButton("🔍 Подробнее", callback_data=CODEC.encode("product_details", product.id)),
+            types.InlineKeyboardButton("🛒 Заказать", callback_data=CODEC.encode("product_order", product.id))
+        )
+        caption = f"<b>{product.name}</b>\n{product.description}"
+        return ProductCard(product.name, product.image_url, caption, markup.to_json())
+
+    def cards(self, category):
+        with self._lock:
+            if self._version != self.catalog.version:
+                self._cards = {}
+                self._version = self.catalog.version
+            cards = self._cards.get(category)
+            if cards is None:
+                cards = self._cards[category] = [self._render(p) for p in self.catalog.in_category(category)]
+            return cards
+
+    def warm(self):
+        for _, category in CATALOG_CATEGORIES:
+            self.cards(category)
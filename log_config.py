@@ -0,0 +1,55 @@
+"""Настройка логирования процесса.
+
+По умолчанию каждая запись — одна строка JSON (время, уровень, логгер,
+сообщение и поля из extra=...), чтобы логи можно было фильтровать по
+полям. LOG_FORMAT=text включает обычный читаемый формат для локальной
+разработки, LOG_LEVEL задаёт уровень (INFO по умолчанию). Записи
+уровня WARNING и выше дополнительно считаются в метрике log_records_total.
+"""
+import json
+import logging
+import os
+import time
+
+from metrics import LOG_RECORDS
+
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra=...
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в виде одной строки JSON."""
+
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _CountingFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            LOG_RECORDS.inc(record.name, record.levelname.lower())
+        return True
+
+
+def configure_logging():
+    """Настраивает корневой логгер по LOG_FORMAT и LOG_LEVEL."""
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "json") == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    handler.addFilter(_CountingFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
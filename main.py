@@ -1,18 +1,46 @@
 import os
+import atexit
+import fcntl
 import threading
+from contextlib import contextmanager
 import time
 import logging
 from datetime import datetime
-import sqlite3
-import hashlib
 
-# === Отключаем лишние логи ===
+# === Структурированные логи (см. log_config.py); лишние логи отключаем ===
+from log_config import configure_logging
+configure_logging()
 logging.getLogger("gunicorn").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
+logger = logging.getLogger("bot")
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, request, jsonify, send_from_directory
 import telebot
-from telebot import types
+from telebot import apihelper, types
+telebot.logger.handlers.clear()  # записи telebot идут через общий обработчик, без дублей
+
+import broadcast
+from catalog import ProductCatalog, make_product_key
+from conversation_state import MemoryStateStore, SQLiteStateStore
+from db import Database
+from dedup import UpdateDeduplicator
+from fabric_colours import COLOUR_PALETTE, ColourIndex
+from fabric_derivatives import DerivativeStore
+from fabric_index import FABRIC_CATEGORIES, FabricIndex
+from fabric_search import FabricSearchIndex
+from file_id_cache import FileIdCache, send_cached_album, send_cached_photo
+from flood_control import FloodControl
+import keyboards
+from keyboards import ProductCardCache
+import metrics
+from migrations import STATE_MIGRATIONS, migrate
+from outbox import Outbox
+from polling import LongPoller
+import reports
+from router import UpdateRouter
+from send_scheduler import PRIORITY_HIGH, SendScheduler
+from update_workers import UpdateWorkerPool
+from write_behind import WriteBehindQueue
 
 # === Настройки приложения ===
 app = Flask(__name__)
@@ -26,80 +54,121 @@ CHANNEL_ID = "@astra_jaluzi"
 PORT = 8000
 
 # === Инициализация бота ===
-bot = telebot.TeleBot(BOT_TOKEN)
+# threaded=False: обработчики выполняются в потоках UpdateWorkerPool (см. ниже)
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+
+# === Маршрутизация кнопок меню и callback-ов по таблицам (см. router.py) ===
+router = UpdateRouter(codec=keyboards.CODEC)
+router.install(bot)
+
+# === Лимит действий одного пользователя, взвешенный по стоимости (см. flood_control.py) ===
+if os.getenv("FLOOD_CONTROL", "1") == "1":
+    router.flood = FloodControl(rate=float(os.getenv("FLOOD_RATE", "2")), burst=float(os.getenv("FLOOD_BURST", "40")))
+COST_PHOTO_PAGE = 10   # страница образцов — до 10 фото
+COST_CATALOG_PAGE = 5  # карточки товаров категории с фото
+
+# === Все запросы к Bot API идут через планировщик (лимиты, приоритеты, 429) ===
+send_scheduler = SendScheduler(
+    global_rate=float(os.getenv("TG_GLOBAL_RATE", "30")),
+    chat_rate=float(os.getenv("TG_CHAT_RATE", "1")),
+)
+apihelper.CUSTOM_REQUEST_SENDER = send_scheduler.send
+
+# === Адрес Bot API: можно направить на локальную заглушку (benchmarks/fake_bot_api.py) ===
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+# === Пул обработки апдейтов: порядок внутри чата, параллельность между чатами ===
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))
+update_workers = UpdateWorkerPool(lambda update: bot.process_new_updates([update]), UPDATE_WORKERS, UPDATE_QUEUE_SIZE)
+update_workers.start()
+send_scheduler.chat_wait = update_workers.parked  # ожидание лимита чата не держит воркер
 
 # === Путь к базе данных ===
-DB_PATH = "blinds_bot.db"
+DB_PATH = os.getenv("DB_PATH", "blinds_bot.db")
+
+# === Соединения с БД: по одному на поток, режим WAL (см. db.py) ===
+db = Database(DB_PATH)
+
+# === Состояние диалогов (шаги и листание): общее для воркеров и реплик (см. conversation_state.py) ===
+# Отдельный файл: частые короткие записи состояния не конкурируют с заявками и логами
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", f"{os.path.splitext(DB_PATH)[0]}.state.db")
+STATE_STORE = os.getenv("STATE_STORE", "sqlite")  # memory — только для одного процесса
+state_db = Database(STATE_DB_PATH)
+conversation_states = SQLiteStateStore(state_db) if STATE_STORE == "sqlite" else MemoryStateStore()
+router.states = conversation_states
+STEP_TTL = 15 * 60   # сколько ждём номер телефона
+
+# === Фоновая запись пользователей и сообщений (см. write_behind.py) ===
+log_writer = WriteBehindQueue(db)
+log_writer.start()
+
+# === Отсев повторно доставленных апдейтов (см. dedup.py) ===
+UPDATE_DEDUP_PERSIST = os.getenv("UPDATE_DEDUP_PERSIST", "1") == "1"
+update_dedup = UpdateDeduplicator(db if UPDATE_DEDUP_PERSIST else None)
+
+# === Каталог товаров в памяти (см. catalog.py) ===
+product_catalog = ProductCatalog(db)
+
+# === Карточки товаров по категориям: подписи и клавиатуры (см. keyboards.py) ===
+product_cards = ProductCardCache(product_catalog)
+
+# === Кэш file_id: каждое фото загружается в Telegram один раз ===
+photo_cache = FileIdCache(db)
+
+# === Облегчённые копии образцов (см. fabric_derivatives.py) ===
+fabric_derivatives = DerivativeStore()
+
+# === Индекс образцов тканей: строится один раз при старте ===
+fabric_index = FabricIndex()
+
+# === Подбор образцов по цвету: готовый индекс доминирующих цветов (см. fabric_colours.py) ===
+fabric_colours = ColourIndex()
+
+# === Поиск образцов по артикулу, коллекции и цвету (см. fabric_search.py) ===
+fabric_search = FabricSearchIndex(fabric_index)
+FABRIC_SEARCH_LIMIT = 10   # строк в ответе на /search
+FABRIC_SEARCH_PHOTOS = 3   # фото лучших совпадений в ответе на /search
+INLINE_RESULTS_PAGE = 50   # больше Telegram не принимает в одном answerInlineQuery
+
+# === Образцы тканей: альбомы и размер страницы ===
+FABRIC_ALBUM_MODE = os.getenv("FABRIC_ALBUM_MODE", "1") == "1"
+FABRIC_PAGE_SIZE = 10
+FABRIC_PAGE_SIZES = {
+    "рулонка": 10,
+    "зебра": 10,
+    "вертикальные": 10,
+    "вертикальные пластик": 10,
+}
 
 # === Ваш Chat ID для уведомлений ===
 MANAGER_CHAT_ID = 7126605143  # ← Ваш реальный ID
 
-# === Флаг для отслеживания инициализации ===
-_INITIALIZED = False
+# === Вебхук: адрес задаётся окружением; пустой WEBHOOK_HOST — не трогать вебхук ===
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "alekuk999-telegram-blinds-bot--f681.twc1.net")
+# webhook — апдейты приходят на /webhook; polling — процесс сам забирает их через getUpdates (см. polling.py)
+BOT_RUNTIME = os.getenv("BOT_RUNTIME", "webhook")
+POLLING_BATCH = int(os.getenv("POLLING_BATCH", "100"))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "25"))
+STARTUP_LOCK_PATH = f"{DB_PATH}.startup.lock"
+
+# === Готовность процесса к обработке апдейтов (см. startup) ===
+_READY = threading.Event()
 
 # === Инициализация базы данных ===
 def init_db():
-    print("🔧 [DB] Инициализация базы данных...")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            price REAL,
-            category TEXT,
-            image_url TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            product_id INTEGER,
-            user_name TEXT,
-            phone TEXT,
-            address TEXT,
-            status TEXT DEFAULT 'new',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message TEXT,
-            is_from_user BOOLEAN,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-    print("✅ [DB] База данных инициализирована.")
+    logger.info("Инициализация базы данных...")
+    version = migrate(db)
+    logger.info("База данных инициализирована (схема v%s)", version)
+    if STATE_STORE == "sqlite":
+        migrate(state_db, STATE_MIGRATIONS)
 
 # === Добавление тестовых данных с красивыми описаниями ===
 def add_sample_data():
-    print("📚 [DB] Проверка и добавление тестовых данных...")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT COUNT(*) FROM products")
-    if cursor.fetchone()[0] == 0:
+    logger.info("Проверка и добавление тестовых данных...")
+    if db.fetchone("SELECT COUNT(*) FROM products")[0] == 0:
         products = [
             # 🧵 Рулонные шторы
             (
@@ -243,37 +312,21 @@ def add_sample_data():
                 "images/derevyannye_orekh.jpg"
             )
         ]
-        cursor.executemany("INSERT INTO products (name, description, price, category, image_url) VALUES (?, ?, ?, ?, ?)", products)
-        print("✅ [DB] Тестовые товары добавлены.")
-
-    conn.commit()
-    conn.close()
+        rows = [(make_product_key(p[0]),) + p for p in products]
+        db.executemany("INSERT INTO products (product_key, name, description, price, category, image_url) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        product_catalog.invalidate()
+        logger.info("Тестовые товары добавлены")
 
 # === Сохранение данных ===
 def save_user(user):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('INSERT OR REPLACE INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)', (user.id, user.username, user.first_name, user.last_name))
-        conn.commit()
-    except Exception as e:
-        print(f"❌ Ошибка сохранения пользователя: {e}")
-    finally:
-        conn.close()
+    log_writer.upsert_user(user.id, user.username, user.first_name, user.last_name)
 
 def save_message(user_id, text, is_from_user):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('INSERT INTO messages (user_id, message, is_from_user) VALUES (?, ?, ?)', (user_id, text, is_from_user))
-        conn.commit()
-    except Exception as e:
-        print(f"❌ Ошибка сохранения сообщения: {e}")
-    finally:
-        conn.close()
+    log_writer.add_message(user_id, text, is_from_user)
 
 # === Обработчики команд бота ===
 @bot.message_handler(commands=['start'])
+@metrics.instrument_handler
 def send_welcome(message):
     try:
         save_user(message.from_user)
@@ -296,84 +349,72 @@ def send_welcome(message):
         show_main_menu(message, welcome_text)
         
     except Exception as e:
-        print(f"❌ [BOT] Ошибка в /start: {e}")
+        logger.exception("Ошибка в /start: %s", e, extra={"chat_id": message.chat.id})
         bot.reply_to(message, "❌ Произошла ошибка. Попробуйте позже.")
 
 def show_main_menu(message, custom_text=None):
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-    markup.add("📚 Каталог", "🧵 Ткани")
-    markup.add("🔗 Канал", "📞 Контакты")
-    markup.add("💬 WhatsApp", "ℹ️ Помощь")
-    
     if custom_text:
-        bot.send_message(message.chat.id, custom_text, reply_markup=markup)
+        bot.send_message(message.chat.id, custom_text, reply_markup=keyboards.MAIN_MENU)
     else:
-        bot.send_message(message.chat.id, "👇 Выберите нужный раздел:", reply_markup=markup)
+        bot.send_message(message.chat.id, "👇 Выберите нужный раздел:", reply_markup=keyboards.MAIN_MENU)
 
 # === Каталог ===
-@bot.message_handler(func=lambda m: m.text == "📚 Каталог")
+@router.text("📚 Каталог")
 def show_catalog(message):
     save_message(message.from_user.id, message.text, True)
     text = "✨ *Выберите категорию товаров:*"
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    markup.add(types.InlineKeyboardButton("🧵 Рулонные шторы", callback_data="category_Рулонные шторы"))
-    markup.add(types.InlineKeyboardButton("🪟 Горизонтальные жалюзи", callback_data="category_Горизонтальные жалюзи"))
-    markup.add(types.InlineKeyboardButton("🚪 Вертикальные жалюзи", callback_data="category_Вертикальные жалюзи"))
-    markup.add(types.InlineKeyboardButton("🌀 Жалюзи плиссе", callback_data="category_Жалюзи плиссе"))
-    markup.add(types.InlineKeyboardButton("🪵 Деревянные жалюзи", callback_data="category_Деревянные жалюзи"))
-    markup.add(types.InlineKeyboardButton("💬 Написать в WhatsApp", url="https://wa.me/79378222906"))
-    markup.add(types.InlineKeyboardButton("📞 Заказать звонок", callback_data="request_call"))
-    bot.reply_to(message, text, parse_mode='Markdown', reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('category_'))
+    bot.reply_to(message, text, parse_mode='Markdown', reply_markup=keyboards.CATALOG)
+
+@router.token("catalog_category", cost=COST_CATALOG_PAGE)
+def handle_catalog_category(call, ordinal):
+    show_category_products(call, keyboards.CATALOG_CATEGORIES[ordinal][1])
+
+@router.callback(prefix='category_', cost=COST_CATALOG_PAGE)
 def handle_category_selection(call):
-    category = call.data.split('_', 1)[1]
+    """Старый формат кнопок category_{категория}."""
+    show_category_products(call, call.data.split('_', 1)[1])
+
+def show_category_products(call, category):
     bot.answer_callback_query(call.id, text=f"Вы выбрали: {category}")
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, description, image_url FROM products WHERE category = ?", (category,))
-    products = cursor.fetchall()
-    conn.close()
-    if not products:
+    cards = product_cards.cards(category)
+    if not cards:
         bot.send_message(call.message.chat.id, f"📦 В категории *{category}* пока нет товаров.", parse_mode='Markdown')
         return
     bot.send_message(call.message.chat.id, f"📋 *Товары в категории: {category}*", parse_mode='Markdown')
-    for product in products:
-        name, desc, image_url = product
-        product_key = hashlib.md5(name.encode()).hexdigest()[:8]
-        markup = types.InlineKeyboardMarkup()
-        markup.add(
-            types.InlineKeyboardButton("🔍 Подробнее", callback_data=f"details_{product_key}"),
-            types.InlineKeyboardButton("🛒 Заказать", callback_data=f"order_{product_key}")
-        )
+    for card in cards:
         try:
-            with open(image_url, 'rb') as photo_file:
-                bot.send_photo(call.message.chat.id, photo_file, caption=f"<b>{name}</b>\n{desc}", parse_mode='HTML', reply_markup=markup)
+            send_cached_photo(bot, photo_cache, call.message.chat.id, card.image_url, caption=card.caption, parse_mode='HTML', reply_markup=card.markup)
         except Exception as e:
-            print(f"❌ Ошибка отправки фото {image_url}: {e}")
-            bot.send_message(call.message.chat.id, f"❌ Не удалось загрузить фото для '{name}'.")
+            logger.error("Ошибка отправки фото %s: %s", card.image_url, e, extra={"chat_id": call.message.chat.id})
+            bot.send_message(call.message.chat.id, f"❌ Не удалось загрузить фото для '{card.name}'.")
     show_main_menu(call.message)
 
 # === 🆕 КНОПКА "ТКАНИ" С ПОДПАПКАМИ (ИСПРАВЛЕНО) ===
-@bot.message_handler(func=lambda m: m.text == "🧵 Ткани")
+@router.text("🧵 Ткани")
 def show_fabric_categories(message):
     """Показывает список категорий тканей."""
-    categories = [
-        "зебра", "рулонка", "плиссе", "вертикальные",
-        "вертикальные пластик", "дерево50", "дерево25мм", "алюминий25мм"
-    ]
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    buttons = [types.InlineKeyboardButton(cat, callback_data=f"fabric:{cat}") for cat in categories]
-    markup.add(*buttons)
-    bot.send_message(message.chat.id, "🧵 *Выберите категорию ткани:*", reply_markup=markup, parse_mode='Markdown')
+    bot.send_message(message.chat.id, "🧵 *Выберите категорию ткани:*", reply_markup=keyboards.FABRIC_CATEGORIES_MENU, parse_mode='Markdown')
+
+@router.token("fabric_category", cost=COST_PHOTO_PAGE)
+def handle_fabric_token(call, ordinal):
+    open_fabric_category(call, keyboards.FABRIC_CATEGORY_NAMES[ordinal])
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('fabric:'))
+@router.token("fabric_page", cost=COST_PHOTO_PAGE)
+def handle_fabric_page(call, ordinal, offset):
+    bot.answer_callback_query(call.id)
+    show_fabric_samples(call.message, keyboards.FABRIC_CATEGORY_NAMES[ordinal], offset=offset)
+
+@router.callback(prefix='fabric:', cost=COST_PHOTO_PAGE)
 def handle_fabric_category(call):
-    category = call.data.split(':', 1)[1]
-    show_fabric_samples(call.message, category, offset=0)
+    """Старый формат кнопок fabric:{категория}."""
+    open_fabric_category(call, call.data.split(':', 1)[1])
+
+def open_fabric_category(call, category):
     bot.answer_callback_query(call.id)
+    save_message(call.from_user.id, f"fabric:{category}", True)  # для сводки по категориям (см. reports.py)
+    show_fabric_samples(call.message, category, offset=0)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('fabric_next:'))
+@router.callback(prefix='fabric_next:', cost=COST_PHOTO_PAGE)
 def handle_fabric_next(call):
     try:
         _, data = call.data.split(':', 1)
@@ -382,81 +423,206 @@ def handle_fabric_next(call):
         show_fabric_samples(call.message, category, offset=offset)
         bot.answer_callback_query(call.id)
     except Exception as e:
-        print(f"❌ Ошибка обработки 'Показать ещё': {e}")
+        logger.exception("Ошибка обработки 'Показать ещё': %s", e)
         bot.answer_callback_query(call.id)
         bot.send_message(call.message.chat.id, "❌ Не удалось загрузить следующую партию. Попробуйте выбрать категорию заново.")
 
-def show_fabric_samples(message, category, offset=0, batch_size=10):
-    folder_map = {
-        "зебра": "zebra",
-        "рулонка": "rulonka",
-        "плиссе": "plisse",
-        "вертикальные": "vertikalnye",
-        "вертикальные пластик": "vertikalnye_plastik",
-        "дерево50": "derevo50",
-        "дерево25мм": "derevo25mm",
-        "алюминий25мм": "alyuminij25mm"
-    }
-    
-    folder = folder_map.get(category)
-    if not folder:
+@router.callback(exact="page_next", cost=COST_PHOTO_PAGE)
+def handle_page_next(call):
+    """Кнопки «Показать ещё», отправленные до перехода на токены: список из слота page."""
+    bot.answer_callback_query(call.id)
+    page = conversation_states.get(call.message.chat.id, "page")
+    if page is None:
+        bot.send_message(call.message.chat.id, "⌛ Список устарел. Выберите категорию или цвет заново.")
+        return
+    try:
+        if page["kind"] == "colour":
+            show_colour_matches(call.message, page["key"], page["offset"])
+        else:
+            show_fabric_samples(call.message, page["key"], offset=page["offset"])
+    except Exception as e:
+        logger.exception("Ошибка обработки 'Показать ещё': %s", e, extra={"chat_id": call.message.chat.id})
+        bot.send_message(call.message.chat.id, "❌ Не удалось загрузить следующую партию. Попробуйте выбрать категорию заново.")
+
+def show_fabric_samples(message, category, offset=0, batch_size=None):
+    if category not in FABRIC_CATEGORIES:
         bot.send_message(message.chat.id, "❌ Категория не найдена.")
         return
 
-    path = f"fabric-samples/{folder}"
-    if not os.path.exists(path):
+    if not fabric_index.has_folder(category):
         bot.send_message(message.chat.id, f"❌ Папка '{category}' не найдена.")
         return
 
-    all_files = sorted([f for f in os.listdir(path) if f.lower().endswith('.jpg')])
-    total = len(all_files)
-
+    total = fabric_index.total(category)
     if total == 0:
         bot.send_message(message.chat.id, f"В категории '{category}' пока нет образцов.")
         return
 
-    files_to_send = all_files[offset:offset + batch_size]
-    for filename in files_to_send:
-        try:
-            # Извлекаем название ткани из имени файла
-            fabric_name = os.path.splitext(filename)[0]
-            fabric_name = fabric_name.replace("_", " ").title()
-            
-            with open(f"{path}/{filename}", 'rb') as photo:
-                bot.send_photo(
-                    message.chat.id, 
-                    photo, 
-                    caption=f"• *{category}*\n• Артикул: `{fabric_name}`", 
-                    parse_mode='Markdown'
-                )
-        except Exception as e:
-            print(f"❌ Ошибка отправки {filename}: {e}")
+    if batch_size is None:
+        batch_size = FABRIC_PAGE_SIZES.get(category, FABRIC_PAGE_SIZE)
+
+    items = []
+    for entry in fabric_index.page(category, offset, batch_size):
+        items.append((fabric_derivatives.resolve(entry.path), fabric_caption(category, entry), 'Markdown'))
+
+    if FABRIC_ALBUM_MODE:
+        send_cached_album(bot, photo_cache, message.chat.id, items)
+    else:
+        for photo_path, caption, parse_mode in items:
+            try:
+                send_cached_photo(bot, photo_cache, message.chat.id, photo_path, caption=caption, parse_mode=parse_mode)
+            except Exception as e:
+                logger.error("Ошибка отправки %s: %s", photo_path, e, extra={"chat_id": message.chat.id})
 
     if offset + batch_size < total:
         next_offset = offset + batch_size
-        callback_data = f"fabric_next:{category}:{next_offset}"
-        if len(callback_data.encode('utf-8')) > 64:
-            callback_data = callback_data[:60] + "..."
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("➡️ Показать ещё", callback_data=callback_data))
-        bot.send_message(message.chat.id, f"Показано {min(offset+batch_size, total)} из {total} образцов.", reply_markup=markup)
+        callback_data = keyboards.CODEC.encode("fabric_page", keyboards.FABRIC_CATEGORY_ORDINALS[category], next_offset)
+        bot.send_message(message.chat.id, f"Показано {min(offset+batch_size, total)} из {total} образцов.", reply_markup=keyboards.show_more(callback_data))
+
+# === 🎨 Подбор ткани по цвету ===
+@router.callback(exact="fabric_colour")
+def show_colour_picker(call):
+    bot.answer_callback_query(call.id)
+    if not fabric_colours.available():
+        bot.send_message(call.message.chat.id, "🎨 Подбор по цвету пока недоступен. Посмотрите образцы по категориям или найдите ткань через /search.")
+        return
+    bot.send_message(call.message.chat.id, "🎨 Какой цвет ищете?", reply_markup=keyboards.COLOUR_PICKER)
+
+@router.token("colour", cost=COST_PHOTO_PAGE)
+def handle_colour_token(call, colour):
+    pick_colour(call, colour)
+
+@router.token("colour_page", cost=COST_PHOTO_PAGE)
+def handle_colour_page(call, colour, offset):
+    pick_colour(call, colour, offset)
+
+@router.callback(prefix="colour:", cost=COST_PHOTO_PAGE)
+def handle_colour(call):
+    """Старый формат кнопок colour:{цвет}[:{смещение}]."""
+    parts = call.data.split(':')
+    try:
+        colour = int(parts[1])
+        offset = int(parts[2]) if len(parts) > 2 else 0
+    except ValueError:
+        bot.answer_callback_query(call.id)
+        bot.send_message(call.message.chat.id, "❌ Цвет не найден.")
+        return
+    pick_colour(call, colour, max(0, offset))
+
+def pick_colour(call, colour, offset=0):
+    try:
+        bot.answer_callback_query(call.id)
+        if not 0 <= colour < len(COLOUR_PALETTE):
+            bot.send_message(call.message.chat.id, "❌ Цвет не найден.")
+            return
+        show_colour_matches(call.message, colour, offset)
+    except Exception as e:
+        logger.exception("Ошибка подбора по цвету: %s", e)
+        bot.send_message(call.message.chat.id, "❌ Не удалось подобрать образцы. Попробуйте ещё раз.")
+
+def show_colour_matches(message, colour, offset=0):
+    paths, total = fabric_colours.nearest(colour, offset, FABRIC_PAGE_SIZE)
+    items = []
+    for path in paths:
+        found = fabric_index.entry_for(path)
+        if found is not None:
+            category, entry = found
+            items.append((fabric_derivatives.resolve(entry.path), fabric_caption(category, entry), 'Markdown'))
+
+    label = COLOUR_PALETTE[colour][0]
+    if not items:
+        bot.send_message(message.chat.id, f"😕 Образцов цвета «{label}» не нашлось.")
+        return
+
+    send_cached_album(bot, photo_cache, message.chat.id, items)
+    if offset + FABRIC_PAGE_SIZE < total:
+        next_offset = offset + FABRIC_PAGE_SIZE
+        bot.send_message(message.chat.id, f"{label}: показано {next_offset} из {total} похожих образцов.",
+                         reply_markup=keyboards.show_more(keyboards.CODEC.encode("colour_page", colour, next_offset)))
+
+def fabric_caption(category, entry):
+    return f"• *{category}*\n• Артикул: `{entry.name}`"
+
+# === 🔎 Поиск ткани: /search и inline-режим ===
+@bot.message_handler(commands=['search'])
+@metrics.instrument_handler
+def search_fabrics(message):
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        bot.reply_to(message, "🔎 Напишите после команды артикул, коллекцию или цвет, например:\n`/search стандарт серый` или `/search 1852`", parse_mode='Markdown')
+        return
+
+    hits = fabric_search.search(query)
+    if not hits:
+        bot.reply_to(message, f"😕 По запросу «{query}» ничего не найдено.")
+        return
+
+    lines = [f"🔎 Найдено образцов: {len(hits)}"]
+    lines.extend(f"• {hit.category}: `{hit.entry.name}`" for hit in hits[:FABRIC_SEARCH_LIMIT])
+    bot.reply_to(message, "\n".join(lines), parse_mode='Markdown', reply_markup=keyboards.search_more(query))
+
+    items = [(fabric_derivatives.resolve(hit.entry.path), fabric_caption(hit.category, hit.entry), 'Markdown')
+             for hit in hits[:FABRIC_SEARCH_PHOTOS]]
+    send_cached_album(bot, photo_cache, message.chat.id, items)
+
+def fabric_media_url(path):
+    """Публичный URL копии из кэша образцов (исходники наружу не отдаются)."""
+    if not path or not WEBHOOK_HOST:
+        return None
+    relative = os.path.relpath(path, fabric_derivatives.cache_dir)
+    if relative.startswith('..'):
+        return None
+    return f"https://{WEBHOOK_HOST}/fabric-media/{relative}"
+
+def inline_fabric_result(hit):
+    """Фото по file_id, если оно уже загружалось; иначе по URL миниатюры; иначе текстом."""
+    result_id = f"{hit.entry.ordinal}:{hit.category}"
+    caption = fabric_caption(hit.category, hit.entry)
+    photo_path = fabric_derivatives.resolve(hit.entry.path)
+    try:
+        file_id = photo_cache.get(photo_path)
+    except OSError:
+        file_id = None
+    if file_id:
+        return types.InlineQueryResultCachedPhoto(result_id, file_id, title=hit.entry.name, caption=caption, parse_mode='Markdown')
+
+    thumb_url = fabric_media_url(fabric_derivatives.thumbnail(hit.entry.path))
+    photo_url = fabric_media_url(photo_path)
+    if photo_url and thumb_url:
+        return types.InlineQueryResultPhoto(result_id, photo_url, thumb_url, title=hit.entry.name, caption=caption, parse_mode='Markdown')
+
+    description = " · ".join(part for part in (hit.category, hit.article.colour, hit.article.width) if part)
+    return types.InlineQueryResultArticle(
+        result_id, hit.entry.name, types.InputTextMessageContent(caption, parse_mode='Markdown'),
+        description=description, thumbnail_url=thumb_url
+    )
+
+@bot.inline_handler(func=lambda inline_query: True)
+@metrics.instrument_handler
+def inline_fabric_search(inline_query):
+    """Inline-режим (@бот запрос); должен быть включён в @BotFather (/setinline)."""
+    try:
+        offset = int(inline_query.offset) if inline_query.offset else 0
+        hits = fabric_search.search(inline_query.query) if inline_query.query.strip() else []
+        page = hits[offset:offset + INLINE_RESULTS_PAGE]
+        next_offset = str(offset + INLINE_RESULTS_PAGE) if offset + INLINE_RESULTS_PAGE < len(hits) else ""
+        bot.answer_inline_query(inline_query.id, [inline_fabric_result(hit) for hit in page], cache_time=300, next_offset=next_offset)
+    except Exception as e:
+        logger.exception("Ошибка inline-поиска: %s", e)
 
 # === Обработчик "Подробнее" ===
-@bot.callback_query_handler(func=lambda call: call.data.startswith('details_'))
+@router.token("product_details")
+def handle_product_details(call, product_id):
+    show_product_details(call, product_catalog.get_by_id(product_id))
+
+@router.callback(prefix='details_')
 def handle_details_button(call):
+    """Старый формат кнопок details_{ключ товара}."""
+    show_product_details(call, product_catalog.get(call.data.split('_', 1)[1]))
+
+def show_product_details(call, product):
     try:
-        product_key = call.data.split('_', 1)[1]
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM products")
-        all_products = cursor.fetchall()
-        conn.close()
-
-        product_name = "товар"
-        for (name,) in all_products:
-            if hashlib.md5(name.encode()).hexdigest()[:8] == product_key:
-                product_name = name
-                break
+        product_name = product.name if product else "товар"
 
         bot.send_message(
             call.message.chat.id,
@@ -464,61 +630,78 @@ def handle_details_button(call):
             "Хотите узнать точную цену, выбрать цвет или заказать бесплатный замер?\n\n"
             "📲 Напишите нам удобным способом:",
             parse_mode='Markdown',
-            reply_markup=types.InlineKeyboardMarkup([
-                [types.InlineKeyboardButton("💬 Написать в WhatsApp", url="https://wa.me/79378222906")],
-                [types.InlineKeyboardButton("✉️ Написать в Telegram", url="https://t.me/astra_jalyzi30")]
-            ])
+            reply_markup=keyboards.CONTACT_US
         )
         bot.answer_callback_query(call.id)
 
     except Exception as e:
-        print(f"❌ Ошибка в handle_details_button: {e}")
+        logger.exception("Ошибка в show_product_details: %s", e)
+        bot.answer_callback_query(call.id)
+        bot.send_message(call.message.chat.id, "❌ Произошла ошибка. Попробуйте позже.")
+
+# === Обработчик "Заказать" ===
+@router.token("product_order")
+def handle_product_order(call, product_id):
+    order_product(call, product_catalog.get_by_id(product_id))
+
+@router.callback(prefix='order_')
+def handle_order_button(call):
+    """Старый формат кнопок order_{ключ товара}."""
+    order_product(call, product_catalog.get(call.data.split('_', 1)[1]))
+
+def order_product(call, product):
+    try:
         bot.answer_callback_query(call.id)
+        ask_for_phone(call.message.chat.id, call.from_user.first_name, product)
+    except Exception as e:
+        logger.exception("Ошибка в order_product: %s", e)
         bot.send_message(call.message.chat.id, "❌ Произошла ошибка. Попробуйте позже.")
 
 # === Прочие обработчики ===
-@bot.message_handler(func=lambda m: m.text == "📞 Контакты")
+@router.text("📞 Контакты")
 def show_contacts(message):
     bot.reply_to(message, "📍 *Контактная информация:*\n\n📞 Телефон: +7 (937) 822-29-06\n💬 WhatsApp: [Написать](https://wa.me/79378222906)\n✉️ Telegram: [Написать менеджеру](https://t.me/astra_jalyzi30)\n⏰ Режим работы: 9:00 — 19:00\n🏠 Адрес: г. Астрахань, ул. Ленина, д. 10, офис 5", parse_mode='Markdown', disable_web_page_preview=False)
 
-@bot.message_handler(func=lambda m: m.text == "💬 WhatsApp")
+@router.text("💬 WhatsApp")
 def open_whatsapp(message):
-    bot.reply_to(message, "💬 Напишите нам прямо сейчас в WhatsApp:\n\nhttps://wa.me/79378222906", reply_markup=types.InlineKeyboardMarkup([[types.InlineKeyboardButton("📲 Открыть чат", url="https://wa.me/79378222906")]]))
+    bot.reply_to(message, "💬 Напишите нам прямо сейчас в WhatsApp:\n\nhttps://wa.me/79378222906", reply_markup=keyboards.WHATSAPP)
 
-@bot.message_handler(func=lambda m: m.text == "🔗 Канал")
+@router.text("🔗 Канал")
 def open_channel(message):
     bot.reply_to(message, f"📢 Перейдите в наш Telegram-канал:\n\n{CHANNEL_ID}", disable_web_page_preview=False)
 
-@bot.message_handler(func=lambda m: m.text == "ℹ️ Помощь")
+@router.text("ℹ️ Помощь")
 def send_help(message):
-    bot.reply_to(message, "📌 *Доступные функции бота:*\n\n• *Каталог* — посмотреть все товары с фото\n• *Ткани* — выбрать материал\n• *Контакты* — узнать адрес и телефон\n• *Канал* — новости и акции\n• *WhatsApp* — написать мгновенно\n\n💡 Все запросы обрабатываются вручную — мы перезваниваем в течение 15 минут!", parse_mode='Markdown')
+    bot.reply_to(message, "📌 *Доступные функции бота:*\n\n• *Каталог* — посмотреть все товары с фото\n• *Ткани* — выбрать материал\n• *Контакты* — узнать адрес и телефон\n• *Канал* — новости и акции\n• *WhatsApp* — написать мгновенно\n• */search* — найти ткань по артикулу, коллекции или цвету\n\n💡 Все запросы обрабатываются вручную — мы перезваниваем в течение 15 минут!", parse_mode='Markdown')
 
 # === 📞 ЗАКАЗ ЗВОНКА (ИСПРАВЛЕНО) ===
-@bot.callback_query_handler(func=lambda call: call.data == "request_call")
+@router.callback(exact="request_call")
 def request_call_handler(call):
     try:
         bot.answer_callback_query(call.id)
-        msg = bot.send_message(
-            call.message.chat.id,
-            "📞 *Пожалуйста, отправьте ваш номер телефона*, и мы перезвоним вам в течение 5 минут!\n\n"
-            "📱 Вы можете:\n"
-            "• Нажать кнопку *«Отправить номер»* ниже\n"
-            "• Или ввести номер вручную (например: `+79271234567`)",
-            parse_mode='Markdown',
-            reply_markup=types.ReplyKeyboardMarkup(
-                row_width=1,
-                resize_keyboard=True,
-                one_time_keyboard=True
-            ).add(
-                types.KeyboardButton("📲 Отправить мой номер", request_contact=True)
-            )
-        )
-        bot.register_next_step_handler(msg, process_phone_number, call.from_user.first_name)
+        ask_for_phone(call.message.chat.id, call.from_user.first_name)
     except Exception as e:
-        print(f"❌ Ошибка в request_call_handler: {e}")
+        logger.exception("Ошибка в request_call_handler: %s", e)
         bot.send_message(call.message.chat.id, "❌ Произошла ошибка. Попробуйте позже.")
 
-def process_phone_number(message, user_name):
+def ask_for_phone(chat_id, user_name, product=None):
+    """Просит номер телефона; ответ обработает process_phone_number (шаг await_phone)."""
+    product_line = f"🛒 Товар: *{product.name}*\n\n" if product else ""
+    bot.send_message(
+        chat_id,
+        product_line +
+        "📞 *Пожалуйста, отправьте ваш номер телефона*, и мы перезвоним вам в течение 5 минут!\n\n"
+        "📱 Вы можете:\n"
+        "• Нажать кнопку *«Отправить номер»* ниже\n"
+        "• Или ввести номер вручную (например: `+79271234567`)",
+        parse_mode='Markdown',
+        reply_markup=keyboards.REQUEST_PHONE
+    )
+    router.expect(chat_id, "await_phone", ttl=STEP_TTL, user_name=user_name, product_id=product.id if product else None)
+
+@router.step("await_phone")
+def process_phone_number(message, state):
+    user_name, product_id = state["user_name"], state.get("product_id")
     try:
         if message.contact:
             phone = message.contact.phone_number
@@ -529,82 +712,299 @@ def process_phone_number(message, user_name):
             bot.send_message(message.chat.id, "❌ Не удалось получить номер. Попробуйте снова.")
             return
 
-        save_call_request(message.from_user.id, user_name, phone)
-        notify_manager(user_name, phone)
+        product = product_catalog.get_by_id(product_id) if product_id else None
+        # Менеджеру уведомление отправит outbox в фоне; ответ пользователю — сразу
+        save_call_request(message.from_user.id, user_name, phone, product)
 
         bot.send_message(
             message.chat.id,
             f"✅ Спасибо, {user_name}!\n\nМы получили ваш номер: `{phone}`\n📞 Менеджер перезвонит вам в течение 5 минут!",
             parse_mode='Markdown',
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=keyboards.REMOVE_KEYBOARD
         )
     except Exception as e:
-        print(f"❌ Ошибка в process_phone_number: {e}")
+        logger.exception("Ошибка в process_phone_number: %s", e, extra={"chat_id": message.chat.id})
         bot.send_message(message.chat.id, "❌ Произошла ошибка. Попробуйте позже.")
 
-def save_call_request(user_id, first_name, phone_number):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def save_call_request(user_id, first_name, phone_number, product=None):
+    """Сохраняет заявку и событие для менеджера в одной транзакции.
+
+    Если записать не удалось, уведомление отправляется менеджеру сразу;
+    если не вышло и это, исключение уходит вызывающему — пользователь
+    увидит ошибку, а не «мы получили ваш номер».
+    """
+    product_id = product.id if product else None
+    event = {
+        "order_id": None,
+        "user_name": first_name,
+        "phone": phone_number,
+        "product_name": product.name if product else None,
+        "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
     try:
-        cursor.execute('''
-            INSERT INTO orders (user_id, user_name, phone, status)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, first_name, phone_number, "pending"))
-        conn.commit()
-        print(f"📞 [CALL REQUEST] Заявка от {first_name} (ID: {user_id}, Телефон: {phone_number}) сохранена.")
+        with db.transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO orders (user_id, product_id, user_name, phone, status)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, product_id, first_name, phone_number, "pending"))
+            event["order_id"] = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+            outbox.add(cursor, "call_request", event)
     except Exception as e:
-        print(f"❌ Ошибка сохранения заявки: {e}")
-    finally:
-        conn.close()
+        # Заявка не сохранена: лог — единственная её копия, поэтому пишем её целиком
+        logger.exception("Ошибка сохранения заявки: %s", e, extra={
+            "user_id": user_id, "product_id": product_id, "user_name": first_name, "phone": phone_number,
+        })
+        notify_manager(event)
+        return
+    outbox.wake()
+    logger.info("Заявка на звонок сохранена", extra={"user_id": user_id, "product_id": product_id})
 
-def notify_manager(user_name, phone_number):
-    """Отправляет уведомление в ваш личный чат (не в бота!)"""
-    try:
+def notify_manager(event):
+    """Отправляет уведомление о заявке в личный чат менеджера; вызывается из outbox.
+
+    Исключение не перехватываем: outbox повторит доставку позже.
+    """
+    with send_scheduler.priority(PRIORITY_HIGH):
         bot.send_message(
             MANAGER_CHAT_ID,  # ← Сообщение приходит СЮДА — в ваш личный чат
             f"🔔 *Новая заявка на звонок!*\n\n"
-            f"👤 Имя: {user_name}\n"
-            f"📱 Телефон: `{phone_number}`\n"
-            f"⏰ Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"👤 Имя: {event['user_name']}\n"
+            f"📱 Телефон: `{event['phone']}`\n"
+            + (f"🛒 Товар: {event['product_name']}\n" if event.get('product_name') else "") +
+            f"⏰ Время: {event['created_at']}",
             parse_mode='Markdown'
         )
-        print(f"✅ [NOTIFY] Уведомление отправлено в личный чат (ID: {MANAGER_CHAT_ID})")
-    except Exception as e:
-        print(f"❌ [NOTIFY] Ошибка отправки уведомления: {e}")
-        # Отправляем сообщение в чат бота, если не удалось отправить в личный
-        try:
-            bot.send_message(
-                MANAGER_CHAT_ID,
-                f"⚠️ Не удалось отправить уведомление в личный чат. Проверьте, что вы написали боту первым.\n\nОшибка: {e}"
-            )
-        except:
-            pass
+    logger.info("Уведомление о заявке отправлено менеджеру", extra={"chat_id": MANAGER_CHAT_ID, "order_id": event["order_id"]})
+
+# === Outbox: заявки доходят до менеджера даже после сбоя или недоступности Telegram ===
+outbox = Outbox(db, {"call_request": notify_manager})
+
+# === 📊 Статистика для менеджера (по дневным сводкам, см. reports.py) ===
+def is_manager(message):
+    return message.from_user is not None and message.from_user.id == MANAGER_CHAT_ID
+
+@bot.message_handler(commands=['stats'], func=is_manager)
+@metrics.instrument_handler
+def send_stats(message):
+    """/stats [дней] — заявки по дням, воронка и популярные ткани."""
+    arg = message.text.partition(' ')[2].strip()
+    days = int(arg) if arg.isdigit() else 7
+    report = reports.daily_report(db, days)
+
+    lines = [f"📊 *Статистика за {len(report.days)} дн. (UTC)*", "", "📅 День: заявки / каталог / ткани"]
+    lines.extend(f"`{row.day}`: {row.lead} / {row.catalog} / {row.fabric}" for row in reversed(report.days))
+
+    users = report.users
+    lines += [
+        "",
+        "🔻 *Воронка* (пользователи по дням):",
+        f"• /start: {users['start']}",
+        f"• Каталог: {users['catalog']}",
+        f"• Заявки: {users['lead']} ({reports.conversion(users['lead'], users['catalog']):.1f}% от каталога)",
+    ]
+    if report.top_fabrics:
+        lines += ["", "🧵 *Популярные ткани:*"]
+        lines.extend(f"• {category}: {views}" for category, views in report.top_fabrics)
+    bot.send_message(message.chat.id, "\n".join(lines), parse_mode='Markdown')
+
+# === 📣 Рассылка менеджера всем пользователям (см. broadcast.py) ===
+def command_argument(text):
+    """Всё после команды, включая переводы строк."""
+    parts = (text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+def is_broadcast_photo(message):
+    return is_manager(message) and (message.caption or "").startswith("/broadcast")
+
+@bot.message_handler(commands=['broadcast'], func=is_manager)
+@bot.message_handler(content_types=['photo'], func=is_broadcast_photo)
+@metrics.instrument_handler
+def create_broadcast(message):
+    """/broadcast текст (или фото с такой подписью) — черновик и предпросмотр."""
+    photo_file_id = message.photo[-1].file_id if message.photo else None
+    text = command_argument(message.caption if photo_file_id else message.text)
+    if not text and not photo_file_id:
+        bot.reply_to(message, "📣 Напишите текст после команды: `/broadcast Скидка 20% на зебру до конца месяца!`\nИли отправьте фото с такой подписью.", parse_mode='Markdown')
+        return
+
+    job_id = broadcaster.create(text, photo_file_id, message.from_user.id)
+    bot.send_message(message.chat.id, f"📣 Предпросмотр рассылки #{job_id}. Получателей: {broadcaster.audience_size()}")
+    if photo_file_id:
+        bot.send_photo(message.chat.id, photo_file_id, caption=text or None, reply_markup=keyboards.broadcast_confirm(job_id))
+    else:
+        bot.send_message(message.chat.id, text, reply_markup=keyboards.broadcast_confirm(job_id))
+
+@router.callback(prefix="broadcast:")
+def handle_broadcast_action(call):
+    if call.from_user.id != MANAGER_CHAT_ID:
+        bot.answer_callback_query(call.id)
+        return
+    _, action, job_id = call.data.split(':')
+    job_id = int(job_id)
+    if action == "start" and broadcaster.start(job_id):
+        bot.answer_callback_query(call.id, text="Рассылка запущена")
+        bot.send_message(call.message.chat.id, f"🚀 Рассылка #{job_id} запущена. Отчёт придёт по завершении.",
+                         reply_markup=keyboards.broadcast_running(job_id))
+    elif action == "cancel" and broadcaster.cancel(job_id):
+        bot.answer_callback_query(call.id, text="Рассылка отменена")
+    else:
+        bot.answer_callback_query(call.id, text="Рассылка уже запущена или завершена")
+
+def report_broadcast(job):
+    """Отчёт менеджеру по завершении (или отмене) рассылки."""
+    title = "завершена" if job["status"] == "done" else "остановлена"
+    with send_scheduler.priority(PRIORITY_HIGH):
+        bot.send_message(
+            MANAGER_CHAT_ID,
+            f"📣 Рассылка #{job['id']} {title}\n\n"
+            f"✅ Доставлено: {job['delivered']}\n"
+            f"⚠️ Ошибок: {job['failed']}\n"
+            f"🚫 Заблокировали бота (удалены из базы): {job['blocked']}\n"
+            f"⏱ {job['elapsed']:.0f} с, {broadcast.throughput(job):.1f} сообщ./с"
+        )
+
+broadcaster = broadcast.Broadcaster(db, bot, send_scheduler, on_finish=report_broadcast)
 
 # === Вебхук и запуск ===
+def accept_update(update):
+    """Передаёт апдейт в пул воркеров; False — очередь переполнена, апдейт нужно получить повторно."""
+    if update_dedup.seen(update.update_id):
+        return True
+    if not update_workers.submit(update):
+        update_dedup.forget(update.update_id)
+        return False
+    return True
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     json_str = request.get_data().decode('utf-8')
     update = telebot.types.Update.de_json(json_str)
-    bot.process_new_updates([update])
+    if not accept_update(update):
+        # Очередь переполнена — Telegram доставит апдейт повторно
+        return 'busy', 503
     return '', 200
 
+# === Long polling: тот же пул воркеров; offset подтверждается после обработки (см. polling.py) ===
+# Повторы отсеивает сам offset, поэтому update_dedup здесь не нужен: его отметка
+# при приёме потеряла бы апдейт, который Telegram вернёт после падения процесса
+poller = LongPoller(bot, update_workers.submit, db, batch_size=POLLING_BATCH, poll_timeout=POLLING_TIMEOUT)
+if BOT_RUNTIME == "polling":
+    update_workers.on_done = lambda update: poller.complete(update.update_id)
+
+# === Остановка: сначала дообрабатываем апдейты, потом дописываем логи ===
+def shutdown():
+    broadcaster.stop()
+    poller.stop()  # новые апдейты не забираем, принятые дообработает пул
+    update_workers.stop()
+    if BOT_RUNTIME == "polling":
+        poller.commit()  # offset за всеми обработанными: после перезапуска они не повторятся
+    outbox.stop()
+    log_writer.stop()
+    db.close_all()
+    state_db.close_all()
+
+atexit.register(shutdown)
+
 @app.route('/')
 def home():
-    global _INITIALIZED
-    if not _INITIALIZED:
-        init_db()
-        add_sample_data()
-        hostname = "alekuk999-telegram-blinds-bot--f681.twc1.net"
-        webhook_url = f"https://{hostname}/webhook"
+    return jsonify({"status": "running", "version": "final", "updates": update_workers.stats(), "duplicates": update_dedup.stats(),
+                    "states": conversation_states.stats() if STATE_STORE == "sqlite" else None,
+                    "outbox": outbox.stats(), "runtime": BOT_RUNTIME,
+                    "polling": poller.stats() if BOT_RUNTIME == "polling" else None,
+                    "flood": router.flood.stats() if router.flood else None}), 200
+
+# === Метрики в формате Prometheus (см. metrics.py) ===
+metrics.REGISTRY.gauge_func("bot_update_queue_depth", "Апдейты в очередях воркеров", update_workers.queue_depth)
+metrics.REGISTRY.gauge_func("bot_write_behind_queue_depth", "Строки в очереди фоновой записи",
+                            lambda: log_writer.stats()["queue_depth"])
+metrics.REGISTRY.gauge_func("bot_write_behind_dropped", "Строки, отброшенные фоновой записью после ошибок",
+                            lambda: log_writer.stats()["dropped"])
+metrics.REGISTRY.gauge_func("bot_api_waiting_sends", "Запросы, ждущие общего лимита Bot API",
+                            lambda: send_scheduler.stats()["waiting"])
+metrics.REGISTRY.gauge_func("bot_outbox_pending", "Недоставленные события outbox",
+                            lambda: outbox.stats()["pending"])
+metrics.REGISTRY.gauge_func("bot_outbox_dead", "События outbox, доставка которых прекращена",
+                            lambda: outbox.stats()["dead"])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/fabric-media/<path:filename>')
+def fabric_media(filename):
+    """Копии и миниатюры образцов для inline-режима: Telegram скачивает их по URL."""
+    if not filename.endswith('.jpg'):
+        abort(404)
+    return send_from_directory(os.path.abspath(fabric_derivatives.cache_dir), filename, max_age=86400)
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: процесс жив и отвечает."""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: старт завершён, база и кэши готовы."""
+    if not _READY.is_set():
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready", "queue_depth": update_workers.queue_depth()}), 200
+
+# === Старт: миграции, данные и вебхук — один раз на деплой, под файловой блокировкой ===
+@contextmanager
+def startup_lock(path):
+    """Межпроцессная блокировка: воркеры gunicorn проходят старт по очереди."""
+    with open(path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def ensure_webhook():
+    """Ставит вебхук, только если Telegram знает другой адрес."""
+    if BOT_RUNTIME == "polling":
+        # Пока вебхук установлен, getUpdates отвечает ошибкой 409
         try:
             bot.remove_webhook()
-            time.sleep(1)
-            bot.set_webhook(url=webhook_url)
-            print(f"✅ [WEBHOOK] Установлен: {webhook_url}")
+            logger.info("Режим long polling: вебхук снят")
         except Exception as e:
-            print(f"❌ [WEBHOOK] Ошибка: {e}")
-        _INITIALIZED = True
-    return jsonify({"status": "running", "version": "final"}), 200
+            logger.error("Ошибка снятия вебхука: %s", e)
+        return
+    if not WEBHOOK_HOST:
+        logger.info("WEBHOOK_HOST пуст — вебхук не настраивается")
+        return
+    webhook_url = f"https://{WEBHOOK_HOST}/webhook"
+    try:
+        if bot.get_webhook_info().url == webhook_url:
+            logger.info("Вебхук уже установлен: %s", webhook_url)
+            return
+        bot.set_webhook(url=webhook_url)
+        logger.info("Вебхук установлен: %s", webhook_url)
+    except Exception as e:
+        logger.error("Ошибка установки вебхука: %s", e)
+
+def startup():
+    started = time.monotonic()
+    with startup_lock(STARTUP_LOCK_PATH):
+        init_db()
+        add_sample_data()
+        ensure_webhook()
+
+    # Прогрев кэшей — в каждом процессе
+    product_catalog.warm()
+    product_cards.warm()
+    fabric_index.load()
+    fabric_search.warm()
+    fabric_colours.load()
+
+    outbox.start()  # после миграций: таблицы outbox и broadcasts уже есть
+    broadcaster.start_worker()  # незавершённая рассылка продолжится с сохранённого курсора
+    _READY.set()
+    if BOT_RUNTIME == "polling":
+        poller.start()  # offset читается из runtime_state, созданной миграциями
+    logger.info("Готов к работе за %.2f с", time.monotonic() - started, extra={"pid": os.getpid()})
+
+startup()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,272 @@
+"""Метрики процесса в формате Prometheus.
+
+Минимальная реализация счётчиков, gauge и гистограмм без внешних
+зависимостей: одно наблюдение — это захват блокировки, bisect по
+границам корзин и пара сложений, поэтому инструментирование можно
+держать включённым в продакшене. Текст для /metrics собирает render().
+
+Метрики бота объявлены в конце модуля; обработчики, вызовы Bot API и
+запросы к SQLite оборачиваются контекстными менеджерами track_*.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм в секундах: от 1 мс до 30 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name}: ожидаются метки {self.label_names}, получено {labels}")
+        return tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+    type_name = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение, которое может расти и уменьшаться."""
+    type_name = "gauge"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class GaugeFunc(_Metric):
+    """Gauge, значение которого читается функцией в момент сбора метрик."""
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, func):
+        super().__init__(name, documentation)
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин (в секундах)."""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.label_names, labels, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def gauge_func(self, name, documentation, func):
+        return self.register(GaugeFunc(name, documentation, func))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+# === Обработчики бота ===
+HANDLER_DURATION = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время выполнения обработчика апдейта", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках", ["handler"])
+HANDLER_IN_FLIGHT = REGISTRY.gauge(
+    "bot_handler_in_flight", "Обработчики, выполняющиеся прямо сейчас", ["handler"])
+THROTTLED = REGISTRY.counter(
+    "bot_throttled_total", "Действия, не выполненные из-за лимита пользователя или повторного нажатия",
+    ["handler", "reason"])
+
+# === Вызовы Bot API (одна HTTP-попытка; повторы считаются отдельно) ===
+API_DURATION = REGISTRY.histogram(
+    "bot_api_request_duration_seconds", "Длительность HTTP-запроса к Bot API", ["method"])
+API_ERRORS = REGISTRY.counter(
+    "bot_api_errors_total", "Неуспешные ответы и сетевые ошибки Bot API", ["method", "code"])
+API_BYTES = REGISTRY.counter(
+    "bot_api_sent_bytes_total", "Байты, отправленные в Bot API (параметры и файлы)", ["method"])
+API_IN_FLIGHT = REGISTRY.gauge(
+    "bot_api_in_flight", "Запросы к Bot API, ожидающие ответа", ["method"])
+
+# === SQLite ===
+DB_DURATION = REGISTRY.histogram(
+    "db_query_duration_seconds", "Время запроса к SQLite, включая ожидание блокировки", ["op"], DB_BUCKETS)
+DB_ERRORS = REGISTRY.counter(
+    "db_errors_total", "Ошибки запросов к SQLite", ["op"])
+
+# === Outbox: доставка уведомлений (см. outbox.py) ===
+OUTBOX_DELIVERIES = REGISTRY.counter(
+    "bot_outbox_deliveries_total", "Попытки доставки событий outbox по результату", ["kind", "result"])
+
+# === Рассылки (см. broadcast.py) ===
+BROADCAST_SENDS = REGISTRY.counter(
+    "bot_broadcast_sends_total", "Сообщения рассылок по результату", ["result"])
+
+# === Логи: обработчики ловят исключения сами, поэтому ошибки видны по записям лога ===
+LOG_RECORDS = REGISTRY.counter(
+    "log_records_total", "Записи лога уровня WARNING и выше", ["logger", "level"])
+
+
+@contextmanager
+def _track(duration, errors, in_flight, labels):
+    in_flight.inc(*labels)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        errors.inc(*labels)
+        raise
+    finally:
+        duration.observe(*labels, value=time.perf_counter() - started)
+        in_flight.dec(*labels)
+
+
+def track_handler(name):
+    """Замер обработчика апдейта с именем name."""
+    return _track(HANDLER_DURATION, HANDLER_ERRORS, HANDLER_IN_FLIGHT, (name,))
+
+
+def instrument_handler(handler):
+    """Декоратор для обработчиков, зарегистрированных в telebot напрямую."""
+    def wrapper(*args, **kwargs):
+        with track_handler(handler.__name__):
+            return handler(*args, **kwargs)
+    wrapper.__name__ = handler.__name__
+    wrapper.__doc__ = handler.__doc__
+    return wrapper
+
+
+@contextmanager
+def track_db(op):
+    """Замер запроса к SQLite; op — execute, executemany, fetchone, fetchall или transaction."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        DB_ERRORS.inc(op)
+        raise
+    finally:
+        DB_DURATION.observe(op, value=time.perf_counter() - started)
+
+
+def payload_size(params, files):
+    """Примерный объём запроса к Bot API: параметры плюс размер файлов."""
+    size = sum(len(str(key)) + len(str(value)) for key, value in (params or {}).items())
+    for value in (files or {}).values():
+        file_obj = value[1] if isinstance(value, tuple) else value
+        if isinstance(file_obj, (bytes, bytearray)):
+            size += len(file_obj)
+        elif hasattr(file_obj, "seek") and hasattr(file_obj, "tell"):
+            position = file_obj.tell()
+            size += file_obj.seek(0, 2) - position
+            file_obj.seek(position)
+    return size
@@ -0,0 +1,278 @@
+"""Версионные миграции схемы SQLite.
+
+Номер применённой миграции хранится в PRAGMA user_version. migrate()
+выполняет недостающие шаги по порядку, каждый — в своей транзакции, так
+что воркеры, стартующие одновременно, не мешают друг другу, а повторный
+запуск ничего не делает. Новая миграция — это новая функция в конце
+списка MIGRATIONS; уже выпущенные миграции не редактируются.
+"""
+import logging
+
+from catalog import make_product_key
+
+logger = logging.getLogger(__name__)
+
+
+def _001_base_schema(cursor):
+    """Исходные таблицы бота, ключ товара и служебные таблицы кэшей."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL,
+            category TEXT,
+            image_url TEXT,
+            product_key TEXT
+        )
+    ''')
+
+    # Стабильный ключ товара для callback-кнопок (в старых базах колонки нет)
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(products)")]
+    if "product_key" not in columns:
+        cursor.execute("ALTER TABLE products ADD COLUMN product_key TEXT")
+    for product_id, name in cursor.execute("SELECT id, name FROM products WHERE product_key IS NULL").fetchall():
+        cursor.execute("UPDATE products SET product_key = ? WHERE id = ?", (make_product_key(name), product_id))
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_key ON products(product_key)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            product_id INTEGER,
+            user_name TEXT,
+            phone TEXT,
+            address TEXT,
+            status TEXT DEFAULT 'new',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message TEXT,
+            is_from_user BOOLEAN,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS photo_file_ids (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            sha256 TEXT,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS seen_updates (
+            update_id INTEGER PRIMARY KEY,
+            seen_at REAL NOT NULL
+        )
+    ''')
+
+
+def _002_outbox(cursor):
+    """Таблица outbox для уведомлений о заявках (см. outbox.py)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+
+# Шаги воронки для дневных сводок: (шаг, таблица, условие на строку; {row} — префикс NEW. в триггере)
+FUNNEL_STAGES = [
+    ("start", "messages", "{row}is_from_user AND {row}message = '/start'"),
+    ("catalog", "messages", "{row}is_from_user AND {row}message = '📚 Каталог'"),
+    ("fabric", "messages", "{row}is_from_user AND {row}message LIKE 'fabric:%'"),
+    ("lead", "orders", "1"),
+]
+
+
+def _003_history_indexes_and_rollups(cursor):
+    """Индексы истории заказов и сообщений, дневные сводки на триггерах."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages (user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, created_at)")
+
+    # Дневные счётчики (дни по UTC): события шага и число разных пользователей на нём
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_funnel_users (
+            day TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (day, stage, user_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_fabric_views (
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            views INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, category)
+        ) WITHOUT ROWID
+    ''')
+
+    for stage, table, condition in FUNNEL_STAGES:
+        history_condition, new_condition = condition.format(row=""), condition.format(row="NEW.")
+        # Уже накопленная история
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO daily_funnel_users (day, stage, user_id)
+            SELECT DISTINCT date(created_at), '{stage}', user_id FROM {table} WHERE {history_condition}
+        ''')
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO daily_stats (day, metric, value)
+            SELECT date(created_at), '{stage}', COUNT(*) FROM {table} WHERE {history_condition} GROUP BY 1
+        ''')
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO daily_stats (day, metric, value)
+            SELECT day, '{stage}_users', COUNT(*) FROM daily_funnel_users WHERE stage = '{stage}' GROUP BY day
+        ''')
+
+        # Новые строки обновляют сводки в той же транзакции, что и вставка
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{stage}_rollup AFTER INSERT ON {table}
+            WHEN {new_condition}
+            BEGIN
+                INSERT INTO daily_stats (day, metric, value) VALUES (date(NEW.created_at), '{stage}', 1)
+                    ON CONFLICT (day, metric) DO UPDATE SET value = value + 1;
+                INSERT INTO daily_stats (day, metric, value)
+                    SELECT date(NEW.created_at), '{stage}_users', 1 WHERE NOT EXISTS (
+                        SELECT 1 FROM daily_funnel_users
+                        WHERE day = date(NEW.created_at) AND stage = '{stage}' AND user_id = NEW.user_id
+                    )
+                    ON CONFLICT (day, metric) DO UPDATE SET value = value + 1;
+                INSERT OR IGNORE INTO daily_funnel_users (day, stage, user_id)
+                    VALUES (date(NEW.created_at), '{stage}', NEW.user_id);
+            END
+        ''')
+
+    cursor.execute('''
+        INSERT OR REPLACE INTO daily_fabric_views (day, category, views)
+        SELECT date(created_at), substr(message, 8), COUNT(*) FROM messages
+        WHERE is_from_user AND message LIKE 'fabric:%' GROUP BY 1, 2
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_messages_fabric_views AFTER INSERT ON messages
+        WHEN NEW.is_from_user AND NEW.message LIKE 'fabric:%'
+        BEGIN
+            INSERT INTO daily_fabric_views (day, category, views) VALUES (date(NEW.created_at), substr(NEW.message, 8), 1)
+                ON CONFLICT (day, category) DO UPDATE SET views = views + 1;
+        END
+    ''')
+
+
+def _004_broadcasts(cursor):
+    """Рассылки менеджера с курсором и счётчиками (см. broadcast.py)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT,
+            photo_file_id TEXT,
+            status TEXT NOT NULL DEFAULT 'draft',
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            elapsed REAL NOT NULL DEFAULT 0,
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_by INTEGER,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status, lease_until)")
+
+
+def _005_runtime_state(cursor):
+    """Служебные значения процесса: offset long polling (см. polling.py)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS runtime_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+MIGRATIONS = [
+    _001_base_schema,
+    _002_outbox,
+    _003_history_indexes_and_rollups,
+    _004_broadcasts,
+    _005_runtime_state,
+]
+
+
+# === Отдельный файл состояния диалогов (см. conversation_state.py) ===
+def _state_001_conversation_state(cursor):
+    """Таблица состояния диалогов по (chat_id, slot) с TTL."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            chat_id INTEGER NOT NULL,
+            slot TEXT NOT NULL,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, slot)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state (expires_at)")
+
+
+STATE_MIGRATIONS = [
+    _state_001_conversation_state,
+]
+
+
+def schema_version(db):
+    return db.fetchone("PRAGMA user_version")[0]
+
+
+def migrate(db, migrations=MIGRATIONS):
+    """Применяет недостающие миграции; возвращает итоговую версию схемы."""
+    for version, migration in enumerate(migrations, start=1):
+        with db.transaction() as cursor:
+            # Версию перечитываем внутри транзакции: её мог поднять другой воркер
+            if schema_version(db) >= version:
+                continue
+            logger.info("Миграция %s: %s", version, migration.__doc__)
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+    return schema_version(db)
@@ -0,0 +1,165 @@
+"""Транзакционный outbox для уведомлений (заявки → менеджеру).
+
+Событие записывается в таблицу outbox в той же транзакции, что и сама
+заявка (add() принимает курсор транзакции), поэтому заявка без
+уведомления или уведомление без заявки невозможны. Отправляет его
+фоновый поток, а не обработчик: пользователь получает ответ сразу.
+
+* Строки забираются пачкой одним UPDATE … RETURNING с «арендой»
+  (next_attempt_at сдвигается на LEASE секунд), так что несколько
+  процессов не отправят одно событие дважды, а событие упавшего
+  процесса подхватится после окончания аренды.
+* Ошибка доставки — повтор с экспоненциальной задержкой и случайной
+  добавкой; после max_attempts (или сразу при ответе 400) событие
+  становится dead и остаётся в таблице вместе с текстом последней ошибки.
+* Доставленные строки удаляются через SENT_RETENTION.
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+from metrics import OUTBOX_DELIVERIES
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_SENT = "sent"
+STATUS_DEAD = "dead"
+
+OUTBOX_INSERT = "INSERT INTO outbox (kind, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)"
+OUTBOX_CLAIM = '''
+    UPDATE outbox SET next_attempt_at = ?
+    WHERE id IN (
+        SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?
+    )
+    RETURNING id, kind, payload, attempts
+'''
+
+
+class Outbox:
+    """Очередь событий в SQLite и фоновый поток их доставки."""
+
+    LEASE = 60                    # секунд на попытку доставки, пока строка «занята»
+    SENT_RETENTION = 7 * 24 * 3600
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, db, handlers, poll_interval=2.0, batch_size=20,
+                 max_attempts=12, base_delay=5.0, max_delay=3600.0):
+        self.db = db
+        self.handlers = handlers  # kind → функция(payload); исключение означает неудачу
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pruned_at = 0.0
+
+    # === Публичный интерфейс ===
+    def add(self, cursor, kind, payload):
+        """Добавляет событие; вызывать внутри транзакции, которая пишет сами данные.
+
+        После COMMIT нужно вызвать wake(): до него поток доставки строку не увидит.
+        """
+        now = time.time()
+        cursor.execute(OUTBOX_INSERT, (kind, json.dumps(payload, ensure_ascii=False), now, now))
+
+    def wake(self):
+        """Будит поток доставки (после коммита транзакции с add())."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Останавливает поток; недоставленное остаётся в базе до следующего запуска."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        rows = self.db.fetchall("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        stats = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_DEAD: 0}
+        stats.update(dict(rows))
+        return stats
+
+    def deliver_due(self):
+        """Одна пачка: забирает готовые к отправке события и доставляет их."""
+        now = time.time()
+        rows = self.db.fetchall(OUTBOX_CLAIM, (now + self.LEASE, now, self.batch_size))
+        for event_id, kind, payload, attempts in sorted(rows):
+            self._deliver(event_id, kind, json.loads(payload), attempts)
+        return len(rows)
+
+    # === Внутренняя кухня ===
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                delivered = self.deliver_due()
+                self._maybe_prune()
+            except Exception as e:
+                logger.error("Ошибка обработки outbox: %s", e)
+                delivered = 0
+            if not delivered:
+                self._wake.wait(self._idle_timeout())
+                self._wake.clear()
+
+    def _idle_timeout(self):
+        """Сколько спать: до ближайшего повтора, но не дольше poll_interval."""
+        try:
+            row = self.db.fetchone("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'")
+        except Exception:
+            return self.poll_interval
+        if row[0] is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.05, row[0] - time.time()))
+
+    def _deliver(self, event_id, kind, payload, attempts):
+        attempts += 1
+        try:
+            self.handlers[kind](payload)
+        except Exception as e:
+            permanent = isinstance(e, ApiTelegramException) and e.error_code == 400
+            if permanent or attempts >= self.max_attempts:
+                self.db.execute(
+                    "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, str(e), event_id)
+                )
+                OUTBOX_DELIVERIES.inc(kind, STATUS_DEAD)
+                logger.error("Событие outbox не доставлено: %s", e,
+                             extra={"event_id": event_id, "kind": kind, "attempts": attempts, "payload": payload})
+                return
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(1.0, 1.25)
+            self.db.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, time.time() + delay, str(e), event_id)
+            )
+            OUTBOX_DELIVERIES.inc(kind, "retry")
+            logger.warning("Повтор доставки через %.0f с: %s", delay, e,
+                           extra={"event_id": event_id, "kind": kind, "attempts": attempts})
+            return
+
+        self.db.execute(
+            "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL WHERE id = ?",
+            (attempts, time.time(), event_id)
+        )
+        OUTBOX_DELIVERIES.inc(kind, STATUS_SENT)
+
+    def _maybe_prune(self):
+        now = time.time()
+        if now - self._pruned_at < self.PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        self.db.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (now - self.SENT_RETENTION,))
@@ -0,0 +1,160 @@
+"""Long polling вместо вебхука (BOT_RUNTIME=polling).
+
+Нужен, когда у бота нет публичного адреса: локальная разработка и
+нагрузочный тест, резервный запуск при недоступном вебхуке. Апдейты
+обрабатывают те же обработчики и тот же пул воркеров (порядок внутри
+чата, параллельность между чатами), что и в режиме вебхука.
+
+* getUpdates забирает пачку до batch_size апдейтов и ждёт новых до
+  poll_timeout секунд (long polling), поэтому пустые опросы редки.
+* Апдейты пачки по одному передаются в accept() (постановка в пул);
+  если пул переполнен, остаток пачки будет запрошен снова после паузы.
+* Подтверждение Telegram — это offset следующего getUpdates. Offset
+  сдвигается только до первого апдейта, который ещё не обработан:
+  пул сообщает об окончании обработки через complete(). Пока апдейт в
+  очереди или в обработчике, Telegram его не забудет, и после падения
+  процесса он придёт снова. Уже принятые апдейты, которые getUpdates
+  возвращает повторно, пропускаются. Пока неподтверждённые апдейты есть,
+  getUpdates отвечает сразу, без long polling, поэтому новые апдейты
+  проверяются не чаще раза в busy_interval секунд (или сразу, как
+  обработан самый старый). Окно одновременно обрабатываемых апдейтов
+  не больше batch_size: если самый старый апдейт застрял, новые ждут его.
+* Offset сохраняется в SQLite (таблица runtime_state): после
+  перезапуска опрос продолжается с того же места. Обработанные, но ещё
+  не подтверждённые апдейты после падения обработаются повторно
+  (доставка «хотя бы один раз»); при штатной остановке commit() после
+  остановки пула сохраняет offset за всеми обработанными апдейтами.
+
+getUpdates может вызывать только один процесс (иначе Telegram отвечает
+409), поэтому в режиме polling бот запускают одним процессом.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+OFFSET_KEY = "polling_offset"
+
+
+class LongPoller:
+    """Цикл getUpdates → accept(update) с подтверждением после обработки."""
+
+    def __init__(self, bot, accept, db=None, batch_size=100, poll_timeout=25, retry_delay=1.0, allowed_updates=None,
+                 busy_interval=0.2):
+        self.bot = bot
+        self.accept = accept  # функция(update) → False, если апдейт не принят
+        self.db = db
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.allowed_updates = allowed_updates
+        self.busy_interval = busy_interval
+        self.offset = None  # подтверждённый offset; читается из базы при запуске, после миграций
+        self._next_id = 0   # первый update_id, который ещё не принимали
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats = {"polls": 0, "empty_polls": 0, "updates": 0, "rejected": 0, "errors": 0}
+
+    # === Публичный интерфейс ===
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.run, name="long-polling", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Останавливает опрос; текущий getUpdates дожидается ответа (до poll_timeout)."""
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def complete(self, update_id):
+        """Апдейт обработан (вызывает пул); неизвестные update_id игнорируются."""
+        with self._cond:
+            if update_id in self._in_flight:
+                self._in_flight.discard(update_id)
+                self._cond.notify_all()
+
+    def commit(self):
+        """Сохраняет offset до первого необработанного апдейта; True, если он сдвинулся."""
+        with self._cond:
+            committed = min(self._in_flight) if self._in_flight else self._next_id
+            if self.offset is None or committed <= self.offset:
+                return False
+            self.offset = committed
+        self._save_offset()
+        return True
+
+    def run(self):
+        if self.offset is None:
+            self.offset = self._next_id = self._load_offset()
+        logger.info("Long polling запущен, offset %s", self.offset)
+        while not self._stopping.is_set():
+            try:
+                accepted_all = self.poll_once()
+            except Exception as e:
+                self._count("errors")
+                logger.error("Ошибка getUpdates: %s", e)
+                accepted_all = False
+            if not accepted_all:
+                self._stopping.wait(self.retry_delay)
+
+    def poll_once(self):
+        """Один getUpdates; False, если часть пачки не принята и её нужно запросить снова."""
+        self.commit()
+        updates = self.bot.get_updates(
+            offset=self.offset or None, limit=self.batch_size, timeout=self.poll_timeout + 10,
+            allowed_updates=self.allowed_updates, long_polling_timeout=self.poll_timeout,
+        )
+        self._count("polls")
+        if not updates:
+            self._count("empty_polls")
+            return True
+
+        fresh = [update for update in updates if update.update_id >= self._next_id]
+        if not fresh:
+            # Вся пачка ещё обрабатывается: ждём самый старый апдейт, но не дольше busy_interval
+            with self._cond:
+                oldest = min(self._in_flight, default=None)
+                if oldest is not None and not self._stopping.is_set():
+                    self._cond.wait_for(lambda: oldest not in self._in_flight or self._stopping.is_set(),
+                                        self.busy_interval)
+            return True
+
+        for update in fresh:
+            with self._cond:
+                self._in_flight.add(update.update_id)
+            if not self.accept(update):
+                with self._cond:
+                    self._in_flight.discard(update.update_id)
+                self._count("rejected")
+                return False
+            self._next_id = update.update_id + 1
+            self._count("updates")
+        return True
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, offset=self.offset, in_flight=len(self._in_flight))
+
+    # === Внутренняя кухня ===
+    def _count(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _load_offset(self):
+        if self.db is None:
+            return 0
+        row = self.db.fetchone("SELECT value FROM runtime_state WHERE key = ?", (OFFSET_KEY,))
+        return int(row[0]) if row else 0
+
+    def _save_offset(self):
+        if self.db is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO runtime_state (key, value) VALUES (?, ?)", (OFFSET_KEY, str(self.offset))
+            )
@@ -0,0 +1,50 @@
+"""Отчёты для менеджера по дневным сводкам.
+
+Сводки daily_stats, daily_fabric_views и daily_funnel_users ведут
+триггеры SQLite при каждой вставке в messages и orders (см.
+migrations._003_history_indexes_and_rollups), поэтому отчёт читает не
+историю, а не больше дней × метрик строк — время ответа не зависит от
+размера истории.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from migrations import FUNNEL_STAGES
+
+MAX_DAYS = 90
+
+DayStats = namedtuple("DayStats", "day start catalog fabric lead")
+Report = namedtuple("Report", "days totals users top_fabrics")
+
+
+def daily_report(db, days=7, top=5):
+    """Сводка за последние days дней (UTC), включая сегодняшний."""
+    days = max(1, min(days, MAX_DAYS))
+    today = datetime.now(timezone.utc).date()
+    since = (today - timedelta(days=days - 1)).isoformat()
+
+    values = {}
+    for day, metric, value in db.fetchall(
+        "SELECT day, metric, value FROM daily_stats WHERE day >= ?", (since,)
+    ):
+        values[(day, metric)] = value
+
+    stages = [stage for stage, _, _ in FUNNEL_STAGES]
+    rows = []
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        rows.append(DayStats(day, *(values.get((day, stage), 0) for stage in stages)))
+
+    # Пользователи на шаге суммируются по дням: вернувшийся назавтра считается снова
+    totals = {stage: sum(getattr(row, stage) for row in rows) for stage in stages}
+    users = {stage: sum(v for (day, metric), v in values.items() if metric == f"{stage}_users") for stage in stages}
+    top_fabrics = db.fetchall(
+        "SELECT category, SUM(views) FROM daily_fabric_views WHERE day >= ? GROUP BY category ORDER BY 2 DESC, 1 LIMIT ?",
+        (since, top)
+    )
+    return Report(rows, totals, users, top_fabrics)
+
+
+def conversion(part, whole):
+    """Доля в процентах; 0, если делить не на что."""
+    return 100.0 * part / whole if whole else 0.0
@@ -0,0 +1,209 @@
+"""Табличная маршрутизация апдейтов.
+
+Вместо цепочки @bot.message_handler(func=lambda m: m.text == ...), где
+каждое сообщение проверяется всеми лямбдами по очереди, кнопки меню
+ищутся в словаре по точному тексту, а callback_data — в словаре точных
+значений и в префиксном дереве (побеждает самый длинный префикс).
+Стоимость поиска не зависит от числа зарегистрированных обработчиков.
+
+В telebot роутер регистрирует по одному обработчику на сообщения и на
+callback-запросы (install), поэтому команды (/start) и next-step
+обработчики telebot продолжают работать как раньше. Каждый вызов
+обработчика замеряется под его именем (см. metrics.track_handler).
+
+Многошаговые диалоги («пришлите номер телефона») не используют
+register_next_step_handler: ожидаемый шаг лежит в общем хранилище
+состояния (states, см. conversation_state.py) в слоте STEP_SLOT, и
+следующее сообщение чата уходит обработчику, зарегистрированному через
+step(). Команда или кнопка меню вместо ответа отменяют шаг.
+
+Если задан flood (см. flood_control.py), перед вызовом обработчика с
+пользователя списывается его стоимость (параметр cost при регистрации),
+а повторные нажатия той же кнопки, пока она обрабатывается, схлопываются.
+
+Компактные callback-токены (см. callback_codec.py) разбираются кодеком
+codec и уходят обработчику действия, зарегистрированному через token();
+он получает аргументы токена: handler(call, *args). Устаревший токен
+не доходит до обработчика — пользователь видит «кнопка устарела».
+"""
+from callback_codec import StaleToken
+from metrics import THROTTLED, track_handler
+
+_HANDLER = object()  # ключ узла дерева, под которым лежит обработчик
+
+STEP_SLOT = "step"
+
+
+class UpdateRouter:
+    """Словарь текстов меню + словарь/префиксное дерево для callback_data."""
+
+    def __init__(self, states=None, flood=None, codec=None):
+        self.states = states
+        self.flood = flood
+        self.codec = codec
+        self._tokens = {}
+        self.bot = None
+        self._costs = {}
+        self._texts = {}
+        self._exact_callbacks = {}
+        self._callback_trie = {}
+        self._steps = {}
+
+    # === Регистрация ===
+    def text(self, *texts, cost=1):
+        """Декоратор: обработчик сообщений с точно таким текстом."""
+        def decorator(handler):
+            for text in texts:
+                self._texts[text] = handler
+            self._costs[handler] = cost
+            return handler
+        return decorator
+
+    def callback(self, prefix=None, exact=None, cost=1):
+        """Декоратор: обработчик callback_data, равной exact или начинающейся с prefix.
+
+        cost — сколько токенов лимита пользователя стоит вызов (см. flood_control.py).
+        """
+        def decorator(handler):
+            self._costs[handler] = cost
+            if exact is not None:
+                self._exact_callbacks[exact] = handler
+            if prefix is not None:
+                node = self._callback_trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                node[_HANDLER] = handler
+            return handler
+        return decorator
+
+    def token(self, action, cost=1):
+        """Декоратор: обработчик действия callback-токена; вызывается как handler(call, *args)."""
+        def decorator(handler):
+            self._tokens[action] = handler
+            self._costs[handler] = cost
+            return handler
+        return decorator
+
+    def step(self, name):
+        """Декоратор: обработчик шага name; вызывается как handler(message, data)."""
+        def decorator(handler):
+            self._steps[name] = handler
+            return handler
+        return decorator
+
+    def expect(self, chat_id, name, ttl=None, **data):
+        """Ждать от чата следующего сообщения для шага name."""
+        self.states.set(chat_id, STEP_SLOT, dict(data, step=name), ttl)
+
+    # === Поиск ===
+    def resolve_text(self, text):
+        return self._texts.get(text)
+
+    def resolve_callback(self, data):
+        if not data:
+            return None
+        handler = self._exact_callbacks.get(data)
+        if handler is not None:
+            return handler
+        node = self._callback_trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            handler = node.get(_HANDLER, handler)
+        return handler
+
+    def resolve_token(self, data):
+        """(обработчик, аргументы) токена; (None, None), если токен устарел."""
+        try:
+            action, args = self.codec.decode(data)
+        except StaleToken:
+            return None, None
+        handler = self._tokens.get(action)  # число и границы аргументов проверил кодек
+        if handler is None:
+            return None, None
+        return handler, args
+
+    # === Диспетчеризация ===
+    def has_step(self, message):
+        if self.states is None or not self._steps:
+            return False
+        data = self.states.get(message.chat.id, STEP_SLOT)
+        if data is None:
+            return False
+        text = message.text or ""
+        if text.startswith("/") or text in self._texts:
+            self.states.clear(message.chat.id, STEP_SLOT)  # пользователь ушёл в меню
+            return False
+        return data.get("step") in self._steps
+
+    def dispatch_step(self, message):
+        # take() атомарен: если апдейт дошёл до двух воркеров, шаг выполнит один
+        data = self.states.take(message.chat.id, STEP_SLOT)
+        handler = self._steps.get(data.get("step")) if data else None
+        if handler is not None:
+            with track_handler(handler.__name__):
+                handler(message, data)
+
+    def has_text(self, message):
+        return message.text in self._texts
+
+    def has_callback(self, call):
+        if self.codec is not None and self.codec.is_token(call.data):
+            return True  # устаревший токен тоже получает ответ
+        return self.resolve_callback(call.data) is not None
+
+    def dispatch_message(self, message):
+        handler = self.resolve_text(message.text)
+        if handler is None:
+            return
+        if self.flood is not None:
+            wait = self.flood.acquire(message.from_user.id, self._costs.get(handler, 1))
+            if wait:
+                THROTTLED.inc(handler.__name__, "rate")
+                if self.flood.should_warn(message.from_user.id, wait):
+                    self.bot.send_message(message.chat.id, f"⏳ Слишком много запросов. Подождите {wait:.0f} с.")
+                return
+        with track_handler(handler.__name__):
+            handler(message)
+
+    def dispatch_callback(self, call):
+        if self.codec is not None and self.codec.is_token(call.data):
+            handler, args = self.resolve_token(call.data)
+            if handler is None:
+                self.bot.answer_callback_query(call.id, text="⌛ Кнопка устарела. Откройте меню заново.")
+                return
+        else:
+            handler, args = self.resolve_callback(call.data), ()
+            if handler is None:
+                return
+        if self.flood is None:
+            with track_handler(handler.__name__):
+                handler(call, *args)
+            return
+
+        chat_id = call.message.chat.id if call.message else call.from_user.id
+        key = (chat_id, call.message.message_id if call.message else None, call.data)
+        if not self.flood.begin(key):
+            THROTTLED.inc(handler.__name__, "duplicate")
+            self.bot.answer_callback_query(call.id, text="⏳ Уже загружаем, секунду…")
+            return
+        completed = False
+        try:
+            wait = self.flood.acquire(call.from_user.id, self._costs.get(handler, 1))
+            if wait:
+                THROTTLED.inc(handler.__name__, "rate")
+                self.bot.answer_callback_query(call.id, text=f"⏳ Слишком часто. Подождите {wait:.0f} с и нажмите снова.")
+                return
+            completed = True
+            with track_handler(handler.__name__):
+                handler(call, *args)
+        finally:
+            self.flood.end(key, completed)
+
+    def install(self, bot):
+        """Подключает роутер к telebot; шаги диалогов проверяются раньше всего остального."""
+        self.bot = bot
+        bot.register_message_handler(self.dispatch_step, content_types=['text', 'contact'], func=self.has_step)
+        bot.register_message_handler(self.dispatch_message, content_types=['text'], func=self.has_text)
+        bot.register_callback_query_handler(self.dispatch_callback, func=self.has_callback)
@@ -0,0 +1,274 @@
+"""Единый планировщик исходящих запросов к Bot API.
+
+Подключается как telebot.apihelper.CUSTOM_REQUEST_SENDER, поэтому через
+него проходит каждый bot.send_*, независимо от того, где он вызван.
+
+* Лимиты Telegram соблюдаются заранее: токен-бакет на каждый чат
+  (около 1 сообщения в секунду, небольшой всплеск) и общий бакет
+  (около 30 сообщений в секунду на бота).
+* За общим бакетом стоит очередь с приоритетами: ответы на callback и
+  уведомления менеджеру идут раньше страниц с фотографиями.
+* Ответ 429 не теряет сообщение: чат (для методов без чата — весь бот)
+  ставится на паузу на retry_after плюс случайная добавка, и запрос
+  повторяется. 502/503/504 повторяются с растущей задержкой только для
+  идемпотентных методов (ответ на callback, правка сообщения, служебные
+  get*/set*): запрос send*, на который пришёл 5xx, мог уже дойти до
+  чата, и повтор отправил бы дубль — такой ответ возвращается как есть.
+* Ожидание лимита чата и пауза перед повтором оборачиваются в
+  chat_wait() — UpdateWorkerPool.parked(): пока поток обработчика ждёт
+  свой чат, воркер обслуживает другие чаты. Ожидание общего лимита
+  остаётся обычным блокирующим.
+* Каждая HTTP-попытка замеряется (длительность, объём, ошибки по коду
+  ответа — см. metrics.py).
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from telebot import apihelper
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+# Методы, которые расходуют лимит сообщений
+RATE_LIMITED_METHODS = {
+    "sendMessage", "sendPhoto", "sendMediaGroup", "sendDocument", "sendVideo",
+    "sendAnimation", "sendAudio", "sendVoice", "sendSticker", "sendContact",
+    "sendLocation", "copyMessage", "forwardMessage", "editMessageText",
+    "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+}
+
+METHOD_PRIORITY = {
+    "answerCallbackQuery": PRIORITY_HIGH,
+    "answerInlineQuery": PRIORITY_HIGH,
+    "sendPhoto": PRIORITY_BULK,
+    "sendMediaGroup": PRIORITY_BULK,
+}
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Методы, которые безопасно повторить после 5xx: повтор не создаёт второе сообщение
+IDEMPOTENT_METHODS = {
+    "answerCallbackQuery", "getUpdates", "getMe", "getFile", "getWebhookInfo",
+    "setWebhook", "deleteWebhook", "setMyCommands",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+}
+
+
+class TokenBucket:
+    """Бакет с резервированием: reserve() сразу говорит, сколько ждать."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def reserve(self, now):
+        """Забирает токен (возможно, в долг) и возвращает время ожидания."""
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.paused_until - now)
+
+    def try_take(self, now, cost=1):
+        """Забирает cost токенов, если они есть (без долга); иначе — сколько ждать."""
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class SendScheduler:
+    """Ограничение скорости, приоритеты и повторы для запросов к Bot API."""
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3, jitter=0.5):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self._chat_buckets = {}
+        self._chat_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self.chat_wait = nullcontext  # обёртка долгих ожиданий потока (см. UpdateWorkerPool.parked)
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "rate_limited": 0, "waited_seconds": 0.0}
+
+    # === Приоритеты ===
+    @contextmanager
+    def priority(self, level):
+        """Задаёт приоритет для всех запросов внутри блока with (в этом потоке)."""
+        previous = getattr(self._local, "priority", None)
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _priority_for(self, method_name):
+        explicit = getattr(self._local, "priority", None)
+        if explicit is not None:
+            return explicit
+        return METHOD_PRIORITY.get(method_name, PRIORITY_NORMAL)
+
+    # === Лимиты ===
+    def _chat_bucket(self, chat_id):
+        with self._chat_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 10000:
+                    now = time.monotonic()
+                    self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle(now)}
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return bucket
+
+    def acquire(self, chat_id, priority):
+        """Блокирует поток, пока запрос не уложится в лимиты чата и бота."""
+        started = time.monotonic()
+
+        # 1. Лимит чата: резервируем место и ждём своей очереди вне общей блокировки
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            with self._chat_lock:
+                wait = bucket.reserve(time.monotonic())
+            if wait > 0:
+                with self.chat_wait():
+                    time.sleep(wait)
+
+        # 2. Общий лимит: первым получает токен самый приоритетный из ожидающих
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                if self._waiting[0] == ticket:
+                    wait = self.global_bucket.wait_time(time.monotonic())
+                    if wait <= 0:
+                        self.global_bucket.tokens -= 1
+                        heapq.heappop(self._waiting)
+                        self._cond.notify_all()
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            with self._stats_lock:
+                self._stats["waited_seconds"] += waited
+
+    def pause_chat(self, chat_id, seconds):
+        """Пауза после 429: для чата или, если chat_id нет, для всего бота."""
+        until = time.monotonic() + seconds
+        if chat_id is None:
+            with self._cond:
+                self.global_bucket.pause(until)
+            return
+        bucket = self._chat_bucket(chat_id)
+        with self._chat_lock:
+            bucket.pause(until)
+
+    # === Отправка (CUSTOM_REQUEST_SENDER) ===
+    def send(self, method, url, params=None, files=None, **kwargs):
+        method_name = url.rsplit('/', 1)[-1]
+        limited = method_name in RATE_LIMITED_METHODS
+        chat_id = (params or {}).get("chat_id") if limited else None
+        priority = self._priority_for(method_name)
+        self._count("requests")
+
+        attempt = 0
+        while True:
+            if limited:
+                self.acquire(chat_id, priority)
+            _rewind(files)
+            response = self._request(method_name, method, url, params, files, kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                return response
+            if response.status_code != 429 and method_name not in IDEMPOTENT_METHODS:
+                return response
+
+            attempt += 1
+            self._count("retries")
+            retry_after = None
+            if response.status_code == 429:
+                self._count("rate_limited")
+                try:
+                    retry_after = response.json()["parameters"]["retry_after"]
+                except (ValueError, KeyError, TypeError):
+                    pass
+            delay = (min(2 ** attempt, 30) if retry_after is None else retry_after) + random.uniform(0, self.jitter)
+            logger.warning(
+                "Bot API %s: HTTP %s, повтор #%s через %.1f с", method_name, response.status_code, attempt, delay,
+                extra={"method": method_name, "status": response.status_code, "attempt": attempt, "delay": round(delay, 2)},
+            )
+            if retry_after is not None:
+                # Лимит Telegram: ждут все запросы этого чата (или бота), а не только этот
+                self.pause_chat(chat_id, delay)
+            with self.chat_wait():
+                time.sleep(delay)
+
+    def _request(self, method_name, method, url, params, files, kwargs):
+        """Одна HTTP-попытка с замером длительности, объёма и ошибок."""
+        metrics.API_BYTES.inc(method_name, amount=metrics.payload_size(params, files))
+        metrics.API_IN_FLIGHT.inc(method_name)
+        started = time.perf_counter()
+        try:
+            response = apihelper._get_req_session().request(method, url, params=params, files=files, **kwargs)
+        except Exception:
+            metrics.API_ERRORS.inc(method_name, "network")
+            raise
+        finally:
+            metrics.API_DURATION.observe(method_name, value=time.perf_counter() - started)
+            metrics.API_IN_FLIGHT.dec(method_name)
+        if response.status_code >= 400:
+            metrics.API_ERRORS.inc(method_name, str(response.status_code))
+        return response
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._cond:
+            stats["waiting"] = len(self._waiting)
+        return stats
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+
+def _rewind(files):
+    """Перед повтором возвращает загружаемые файлы в начало."""
+    for value in (files or {}).values():
+        file_obj = value[1] if isinstance(value, tuple) else value
+        if hasattr(file_obj, "seek"):
+            file_obj.seek(0)
@@ -0,0 +1,202 @@
+"""Асинхронная обработка апдейтов Telegram пулом воркеров.
+
+Вебхук только кладёт апдейт в очередь и сразу отвечает Telegram.
+Обработкой занимаются N потоков. У каждого чата своя очередь: пока апдейт
+чата обрабатывается, следующий апдейт этого чата ждёт, поэтому апдейты
+одного чата обрабатываются строго по порядку, а разные чаты — параллельно.
+Если в очередях уже workers × queue_size апдейтов, submit() возвращает
+False: вебхук отвечает 503, и Telegram повторит доставку позже.
+
+Обработчик может надолго уснуть в ожидании лимита своего чата в Bot API
+(около сообщения в секунду, см. send_scheduler.py). Такое ожидание
+оборачивается в parked(): поток перестаёт занимать место воркера, и
+если готовые чаты ждут, а свободных потоков нет, запускается ещё один
+(не больше max_threads). Так занятый чат тормозит только себя. Лишние
+потоки завершаются, простояв idle_timeout секунд.
+
+on_done(update) вызывается после обработки каждого апдейта (и при
+ошибке в обработчике — она уже записана в лог); по нему long polling
+подтверждает апдейты Telegram (см. polling.py).
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update):
+    """chat_id (или id пользователя), к которому относится апдейт."""
+    if update.message:
+        return update.message.chat.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.inline_query:
+        return update.inline_query.from_user.id
+    if update.chosen_inline_result:
+        return update.chosen_inline_result.from_user.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    return update.update_id
+
+
+class UpdateWorkerPool:
+    """Пул потоков с очередью на каждый чат."""
+
+    def __init__(self, handler, workers=4, queue_size=100, max_threads=None, idle_timeout=30.0):
+        self.handler = handler
+        self.on_done = None
+        self.workers = workers
+        self.capacity = workers * queue_size
+        self.max_threads = max_threads or workers * 16
+        self.idle_timeout = idle_timeout
+        self._chats = {}      # chat_id → deque ещё не начатых апдейтов
+        self._ready = deque()  # чаты с апдейтами, которые сейчас никто не обрабатывает
+        self._busy = set()     # чаты, чей апдейт сейчас обрабатывается
+        self._pending = 0
+        self._threads = set()
+        self._running = 0      # потоки в обработчике, кроме припаркованных
+        self._parked = 0
+        self._idle = 0
+        self._accepting = False
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._names = itertools.count()
+        self._local = threading.local()
+        self._stats = {"submitted": 0, "processed": 0, "shed": 0, "errors": 0, "parks": 0}
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._accepting = True
+            self._stopping = False
+            for _ in range(self.workers):
+                self._spawn()
+
+    def submit(self, update):
+        """Ставит апдейт в очередь; False — пул перегружен или останавливается."""
+        chat_id = update_chat_id(update)
+        with self._cond:
+            if not self._accepting or self._pending >= self.capacity:
+                self._stats["shed"] += 1
+                return False
+            chat_queue = self._chats.get(chat_id)
+            if chat_queue is None:
+                chat_queue = self._chats[chat_id] = deque()
+                if chat_id not in self._busy:
+                    self._ready.append(chat_id)
+            chat_queue.append(update)
+            self._pending += 1
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        return True
+
+    @contextmanager
+    def parked(self):
+        """Долгое ожидание внутри обработчика: место воркера на это время отдаётся другим чатам."""
+        if not getattr(self._local, "worker", False):
+            yield
+            return
+        with self._cond:
+            self._running -= 1
+            self._parked += 1
+            self._stats["parks"] += 1
+            if self._ready and self._idle == 0 and len(self._threads) < self.max_threads:
+                self._spawn()
+            self._cond.notify()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._parked -= 1
+                self._running += 1
+
+    def stop(self, timeout=30):
+        """Перестаёт принимать апдейты и дожидается обработки уже принятых."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._accepting = False
+            self._stopping = True
+            self._cond.notify_all()
+        while time.monotonic() < deadline:
+            with self._cond:
+                threads = list(self._threads)
+            if not threads:
+                break
+            for thread in threads:
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+    def queue_depth(self):
+        with self._cond:
+            return self._pending
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(queue_depth=self._pending, workers=self.workers,
+                         threads=len(self._threads), parked=self._parked)
+        return stats
+
+    # === Внутренняя кухня ===
+    def _spawn(self):
+        """Запускает поток-воркер; вызывается под self._cond."""
+        thread = threading.Thread(target=self._run, name=f"update-worker-{next(self._names)}", daemon=True)
+        self._threads.add(thread)
+        thread.start()
+
+    def _next(self):
+        """Следующий апдейт готового чата; None — поток должен завершиться."""
+        idle_since = time.monotonic()
+        with self._cond:
+            while not (self._ready and self._running < self.workers):
+                surplus = len(self._threads) > self.workers
+                idle_left = idle_since + self.idle_timeout - time.monotonic()
+                if (self._stopping and not self._pending) or (surplus and idle_left <= 0):
+                    self._threads.discard(threading.current_thread())
+                    return None
+                self._idle += 1
+                self._cond.wait(idle_left if surplus else None)
+                self._idle -= 1
+            chat_id = self._ready.popleft()
+            chat_queue = self._chats[chat_id]
+            update = chat_queue.popleft()
+            if not chat_queue:
+                del self._chats[chat_id]
+            self._busy.add(chat_id)
+            self._pending -= 1
+            self._running += 1
+            return chat_id, update
+
+    def _done(self, chat_id, key):
+        with self._cond:
+            self._stats[key] += 1
+            self._running -= 1
+            self._busy.discard(chat_id)
+            if chat_id in self._chats:
+                self._ready.append(chat_id)
+            self._cond.notify_all()
+
+    def _run(self):
+        self._local.worker = True
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            chat_id, update = item
+            try:
+                self.handler(update)
+            except Exception as e:
+                logger.exception("Ошибка обработки апдейта %s: %s", update.update_id, e, extra={"update_id": update.update_id})
+                self._done(chat_id, "errors")
+            else:
+                self._done(chat_id, "processed")
+            if self.on_done is not None:
+                self.on_done(update)
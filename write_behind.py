@@ -0,0 +1,172 @@
+"""Отложенная (write-behind) запись пользователей и сообщений.
+
+Обработчик не ждёт диск: save_user/save_message кладут строку в
+ограниченную очередь, а фоновый поток пачками пишет их в SQLite через
+executemany в одной транзакции — по набору batch_size строк или раз в
+flush_interval секунд. Если очередь переполнена, вызывающий ждёт до
+put_timeout, а затем пишет строку сам (данные не теряются). При
+остановке очередь дописывается до конца.
+
+Если пачка не записалась, через retry_delay секунд она пишется ещё раз;
+при повторной ошибке строки пишутся по одной, и теряется только та,
+которую база не принимает (счётчик dropped, виден в /metrics).
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+USER_UPSERT = 'INSERT OR REPLACE INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)'
+MESSAGE_INSERT = 'INSERT INTO messages (user_id, message, is_from_user) VALUES (?, ?, ?)'
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Фоновый писатель с ограниченной очередью и пакетными сбросами."""
+
+    def __init__(self, db, max_queue=10000, batch_size=200, flush_interval=0.5, put_timeout=1.0,
+                 retry_delay=0.2):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "flushes": 0,
+            "rows_written": 0,
+            "sync_fallbacks": 0,
+            "errors": 0,
+            "dropped": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    # === Публичный интерфейс ===
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def upsert_user(self, user_id, username, first_name, last_name):
+        self._put((USER_UPSERT, (user_id, username, first_name, last_name)))
+
+    def add_message(self, user_id, text, is_from_user):
+        self._put((MESSAGE_INSERT, (user_id, text, is_from_user)))
+
+    def stop(self, timeout=10):
+        """Останавливает поток, предварительно записав всё, что осталось в очереди."""
+        if self._thread is None:
+            self._flush(self._drain())
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+    # === Внутренняя кухня ===
+    def _put(self, item):
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            # Обратное давление: очередь не успевает — пишем сами, синхронно
+            self._count("sync_fallbacks")
+            self._flush([item])
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def _drain(self):
+        """Забирает из очереди всё, что там есть, не дожидаясь новых строк."""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if item is not _STOP:
+                batch.append(item)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            stopping = item is _STOP
+            batch = [] if stopping else [item]
+
+            # Добираем пачку до batch_size, но ждём не дольше flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            self._flush(batch)
+            if stopping:
+                self._flush(self._drain())
+                return
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            self._write(batch)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Ошибка записи пачки из %s строк, повтор: %s", len(batch), e)
+            time.sleep(self.retry_delay)
+            try:
+                self._write(batch)
+            except Exception as e:
+                self._count("errors")
+                logger.error("Пачка из %s строк снова не записалась, пишем по одной: %s", len(batch), e)
+                batch = self._write_rows(batch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += len(batch)
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+
+    def _write(self, batch):
+        """Одна транзакция на пачку: строки группируются по запросу для executemany."""
+        grouped = {}
+        for sql, params in batch:
+            grouped.setdefault(sql, []).append(params)
+        with self.db.transaction() as conn:
+            for sql, rows in grouped.items():
+                conn.executemany(sql, rows)
+
+    def _write_rows(self, batch):
+        """Пишет строки по одной; возвращает записанные, остальные отбрасывает."""
+        written = []
+        for item in batch:
+            try:
+                self._write([item])
+            except Exception as e:
+                self._count("dropped")
+                logger.error("Строка пользователя %s не записана и отброшена: %s", item[1][0], e,
+                             extra={"user_id": item[1][0]})
+            else:
+                written.append(item)
+        return written